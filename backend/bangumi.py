@@ -0,0 +1,418 @@
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import quote, urlencode
+
+import httpx
+
+from cache import LRUCache
+
+try:
+    import h2  # noqa: F401  (enables HTTP/2 in httpx)
+    _HTTP2 = True
+except ImportError:
+    _HTTP2 = False
+
+
+BASE_URL = os.getenv("BANGUMI_BASE_URL", "https://api.bgm.tv")
+USER_AGENT = "MyAnimeTrack/1.0 (https://github.com/Restartired/MyAnimeTrack)"
+
+# One keep-alive client for every outbound Bangumi call, so repeated
+# requests reuse the same TLS connection instead of handshaking each time.
+# Async, so a slow Bangumi response only parks a coroutine and never ties
+# up a worker thread.
+client = httpx.AsyncClient(
+    base_url=BASE_URL,
+    http2=_HTTP2,
+    headers={"User-Agent": USER_AGENT, "Accept": "application/json"},
+    timeout=httpx.Timeout(float(os.getenv("BANGUMI_TIMEOUT", "10")), connect=5),
+    limits=httpx.Limits(
+        max_connections=int(os.getenv("BANGUMI_MAX_CONNECTIONS", "20")),
+        max_keepalive_connections=int(os.getenv("BANGUMI_MAX_KEEPALIVE", "10")),
+        keepalive_expiry=60,
+    ),
+)
+
+
+
+class BangumiUnavailable(httpx.HTTPError):
+    """Raised without calling Bangumi while the circuit breaker is open."""
+
+
+class TokenBucket:
+    """Token bucket for coroutines: `rate` requests per second, bursts up to `burst`."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.waits = 0
+
+    async def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+                self.waits += 1
+            await asyncio.sleep(delay)
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures; while open every call
+    fails fast. After `reset_timeout` seconds one trial call is let
+    through, and its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, threshold: int, reset_timeout: float):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"  # closed / open / half_open
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == "closed":
+                return
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                return
+            raise BangumiUnavailable("Bangumi API is unavailable (circuit open), try again later")
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.threshold:
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+    def record_throttled(self):
+        """
+        A 429: Bangumi is up, just rate limiting us. It doesn't count as
+        a failure, but it does settle a trial call, closing the circuit.
+        """
+        with self._lock:
+            if self.state == "half_open":
+                self.state = "closed"
+                self._failures = 0
+
+    def record_abandoned(self):
+        """
+        A call ended without an outcome (cancelled). If it was the trial,
+        go back to open without restarting the timeout, so the next call
+        becomes the trial instead of the circuit staying half open.
+        """
+        with self._lock:
+            if self.state == "half_open":
+                self.state = "open"
+
+
+# Every outbound request is rate limited and retried with jittered
+# exponential backoff (honoring Retry-After) on 429 / 5xx / network errors.
+MAX_RETRIES = int(os.getenv("BANGUMI_MAX_RETRIES", "4"))
+RETRY_BASE_DELAY = float(os.getenv("BANGUMI_RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("BANGUMI_RETRY_MAX_DELAY", "30"))
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_limiter = TokenBucket(
+    rate=float(os.getenv("BANGUMI_RATE_LIMIT", "5")),
+    burst=int(os.getenv("BANGUMI_RATE_BURST", "10")),
+)
+_breaker = CircuitBreaker(
+    threshold=int(os.getenv("BANGUMI_BREAKER_THRESHOLD", "5")),
+    reset_timeout=float(os.getenv("BANGUMI_BREAKER_RESET", "30")),
+)
+
+# Caps how many fan-out requests (e.g. search result details) are in
+# flight at once
+_fanout = asyncio.Semaphore(int(os.getenv("BANGUMI_FANOUT_CONCURRENCY", "5")))
+
+# Response cache: LRU bounded, with a TTL per endpoint. Expired entries
+# are kept and revalidated with ETag / Last-Modified, so a refresh of
+# unchanged data costs a 304 instead of a full body.
+CACHE_ENABLED = os.getenv("BANGUMI_CACHE_ENABLED", "1") != "0"
+CACHE_PATH = os.getenv("BANGUMI_CACHE_PATH")  # optional on-disk snapshot
+CACHE_TTLS = [
+    # (path prefix, seconds); paths not listed here are never cached
+    ("/v0/subjects/", float(os.getenv("BANGUMI_CACHE_TTL_SUBJECTS", "21600"))),
+    ("/v0/episodes", float(os.getenv("BANGUMI_CACHE_TTL_EPISODES", "3600"))),
+    ("/search/subject/", float(os.getenv("BANGUMI_CACHE_TTL_SEARCH", "1800"))),
+]
+
+_cache = LRUCache(int(os.getenv("BANGUMI_CACHE_SIZE", "2000")))
+_counter_lock = threading.Lock()
+_counters = {"hits": 0, "revalidated": 0, "misses": 0, "uncached": 0}
+_request_counters = {"requests": 0, "retries": 0, "failures": 0}
+
+
+def _count(name: str, counters: dict = _counters):
+    with _counter_lock:
+        counters[name] += 1
+
+
+def _retry_after(resp: httpx.Response):
+    value = resp.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+async def _send(path: str, params: dict, headers: dict, timeout, retries: int = None):
+    """
+    Send one GET through the rate limiter and circuit breaker, retrying
+    throttled / failed attempts. Returns the last response; raises on
+    network errors once retries are exhausted.
+    """
+    retries = MAX_RETRIES if retries is None else retries
+    attempt = 0
+    while True:
+        _breaker.before_call()
+        delay = None
+        try:
+            await _limiter.acquire()
+            _count("requests", _request_counters)
+            resp = await client.get(path, params=params, headers=headers, timeout=timeout)
+        except httpx.TransportError:
+            _breaker.record_failure()
+            if attempt >= retries:
+                _count("failures", _request_counters)
+                raise
+        except asyncio.CancelledError:
+            # e.g. a fan-out task dropped at the search deadline
+            _breaker.record_abandoned()
+            raise
+        except BaseException:
+            _breaker.record_failure()
+            _count("failures", _request_counters)
+            raise
+        else:
+            if resp.status_code not in RETRY_STATUSES:
+                _breaker.record_success()
+                return resp
+            # 429 means Bangumi is up but throttling us, so it doesn't trip the breaker
+            if resp.status_code == 429:
+                _breaker.record_throttled()
+            else:
+                _breaker.record_failure()
+            if attempt >= retries:
+                _count("failures", _request_counters)
+                return resp
+            delay = _retry_after(resp)
+
+        backoff = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+        await asyncio.sleep(min(max(delay or 0, backoff), RETRY_MAX_DELAY))
+        attempt += 1
+        _count("retries", _request_counters)
+
+
+def _ttl_for(path: str) -> float:
+    for prefix, ttl in CACHE_TTLS:
+        if path.startswith(prefix):
+            return ttl
+    return 0
+
+
+def _cache_key(path: str, params: dict = None) -> str:
+    if not params:
+        return path
+    return f"{path}?{urlencode(sorted(params.items()))}"
+
+
+def load_cache():
+    if not (CACHE_ENABLED and CACHE_PATH and os.path.exists(CACHE_PATH)):
+        return
+    try:
+        with open(CACHE_PATH, encoding="utf-8") as f:
+            for key, entry in json.load(f):
+                _cache.set(key, entry)
+    except Exception as e:
+        print(f"Failed to load Bangumi cache: {e}")
+
+
+def save_cache():
+    if not (CACHE_ENABLED and CACHE_PATH):
+        return
+    try:
+        tmp_path = f"{CACHE_PATH}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(_cache.items(), f, ensure_ascii=False)
+        os.replace(tmp_path, CACHE_PATH)
+    except Exception as e:
+        print(f"Failed to save Bangumi cache: {e}")
+
+
+def stats():
+    with _counter_lock:
+        requests = dict(_request_counters)
+    return {
+        "cache": cache_stats(),
+        "requests": {
+            **requests,
+            "rate_limit": _limiter.rate,
+            "rate_limited_waits": _limiter.waits,
+            "circuit": _breaker.state,
+        },
+    }
+
+
+def cache_stats():
+    with _counter_lock:
+        counters = dict(_counters)
+    lookups = counters["hits"] + counters["revalidated"] + counters["misses"]
+    return {
+        "enabled": CACHE_ENABLED,
+        "size": len(_cache),
+        "maxsize": _cache.maxsize,
+        "evictions": _cache.evictions,
+        **counters,
+        # Share of cacheable lookups answered without downloading a body
+        "hit_rate": round((counters["hits"] + counters["revalidated"]) / lookups, 4) if lookups else None,
+    }
+
+
+async def close():
+    await client.aclose()
+    save_cache()
+
+
+async def get_json(path: str, params: dict = None, timeout: float = None, revalidate: bool = False, retries: int = None):
+    """
+    GET a Bangumi API path and decode the JSON body.
+
+    Cacheable paths are answered from the local cache while fresh. Once
+    stale (or when `revalidate` is set) the request is made conditional,
+    so unchanged data comes back as a cheap 304.
+
+    Raises httpx.HTTPStatusError on non-2xx responses and other
+    httpx.HTTPError subclasses on network failures / timeouts, including
+    BangumiUnavailable while the circuit breaker is open.
+    """
+    ttl = _ttl_for(path) if CACHE_ENABLED else 0
+    key = _cache_key(path, params)
+    entry = _cache.get(key) if ttl > 0 else None
+
+    if entry and not revalidate and entry["expires_at"] > time.time():
+        _count("hits")
+        return entry["data"]
+
+    headers = {}
+    if entry:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+    resp = await _send(
+        path,
+        params,
+        headers,
+        timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT,
+        retries=retries,
+    )
+
+    if resp.status_code == 304 and entry:
+        _count("revalidated")
+        _cache.set(key, {**entry, "expires_at": time.time() + ttl})
+        return entry["data"]
+
+    resp.raise_for_status()
+    data = resp.json()
+
+    if ttl > 0:
+        _count("misses")
+        _cache.set(key, {
+            "data": data,
+            "etag": resp.headers.get("ETag"),
+            "last_modified": resp.headers.get("Last-Modified"),
+            "expires_at": time.time() + ttl,
+        })
+    else:
+        _count("uncached")
+    return data
+
+
+async def get_subject(subject_id, timeout: float = None, revalidate: bool = False, retries: int = None):
+    return await get_json(f"/v0/subjects/{subject_id}", timeout=timeout, revalidate=revalidate, retries=retries)
+
+
+async def get_subjects(subject_ids, deadline: float) -> dict:
+    """
+    Fetch several subjects concurrently, all sharing one overall deadline.
+
+    Returns {subject_id: data} for the fetches that succeeded in time;
+    failed or late subjects are simply missing from the result.
+    """
+    async def fetch(subject_id):
+        async with _fanout:
+            # No retries: a late detail just falls back to the search payload
+            return await get_subject(subject_id, deadline, retries=0)
+
+    tasks = {asyncio.ensure_future(fetch(subject_id)): subject_id for subject_id in subject_ids}
+    if not tasks:
+        return {}
+    done, not_done = await asyncio.wait(tasks, timeout=deadline)
+    for task in not_done:
+        task.cancel()
+    if not_done:
+        await asyncio.wait(not_done)
+
+    results = {}
+    for task in done:
+        if task.exception() is None:
+            results[tasks[task]] = task.result()
+    return results
+
+
+async def get_episodes(subject_id, limit: int = 100, offset: int = 0, timeout: float = None, revalidate: bool = False):
+    return await get_json(
+        "/v0/episodes",
+        params={"subject_id": subject_id, "limit": limit, "offset": offset},
+        timeout=timeout,
+        revalidate=revalidate
+    )
+
+
+async def get_user_collections(username: str, collection_type: int, limit: int, offset: int):
+    return await get_json(
+        f"/v0/users/{quote(username, safe='')}/collections",
+        params={
+            "subject_type": 2,  # Anime
+            "type": collection_type,
+            "limit": limit,
+            "offset": offset
+        },
+        timeout=15
+    )
+
+
+async def search_subjects(query: str):
+    # type=2 表示动画
+    return await get_json(
+        f"/search/subject/{quote(query, safe='')}",
+        params={"type": 2, "responseGroup": "large"}
+    )
@@ -0,0 +1,146 @@
+"""
+Mixed workload benchmark: slow Bangumi-backed requests running next to
+fast local reads, to see how much the slow ones hold the fast ones up.
+
+    # 1. A stand-in for the Bangumi API that answers after --delay seconds
+    python bench_mixed.py stub --port 9100 --delay 1
+
+    # 2. The API, pointed at the stub and with the rate limit out of the way
+    BANGUMI_BASE_URL=http://127.0.0.1:9100 BANGUMI_RATE_LIMIT=10000 BANGUMI_RATE_BURST=10000 \\
+        uvicorn main:app --port 8000
+
+    # 3. The load: --slow clients loop on GET /bangumi/search (a fresh query
+    #    each time, so the Bangumi cache never answers), --fast clients loop
+    #    on local reads
+    python bench_mixed.py run --url http://127.0.0.1:8000 --duration 20 --slow 64 --fast 8
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+
+import httpx
+
+
+def stub_app(delay: float):
+    from fastapi import FastAPI
+
+    app = FastAPI()
+
+    def subject(subject_id: int):
+        return {
+            "id": subject_id,
+            "name": f"Subject {subject_id}",
+            "name_cn": f"条目 {subject_id}",
+            "date": "2024-04-01",
+            "eps": 12,
+            "images": {"large": f"https://example.invalid/{subject_id}.jpg"},
+            "summary": "",
+        }
+
+    @app.get("/search/subject/{query}")
+    async def search(query: str):
+        await asyncio.sleep(delay)
+        return {"list": [subject(subject_id) for subject_id in range(1, 11)]}
+
+    @app.get("/v0/subjects/{subject_id}")
+    async def get_subject(subject_id: int):
+        await asyncio.sleep(delay)
+        return subject(subject_id)
+
+    @app.get("/v0/episodes")
+    async def get_episodes(subject_id: int, limit: int = 100, offset: int = 0):
+        await asyncio.sleep(delay)
+        return {"data": [], "total": 0, "limit": limit, "offset": offset}
+
+    return app
+
+
+async def _client_loop(client: httpx.AsyncClient, next_path, deadline: float, latencies: list, errors: list):
+    while time.monotonic() < deadline:
+        started = time.monotonic()
+        try:
+            resp = await client.get(next_path())
+            resp.raise_for_status()
+        except httpx.HTTPError as e:
+            errors.append(str(e) or type(e).__name__)
+            continue
+        latencies.append(time.monotonic() - started)
+
+
+def _summary(name: str, latencies: list, errors: list, duration: float):
+    if not latencies:
+        return f"{name:<6} no successful requests, {len(errors)} errors"
+    ordered = sorted(latencies)
+
+    def pct(p):
+        return ordered[min(int(len(ordered) * p), len(ordered) - 1)] * 1000
+
+    return (
+        f"{name:<6} {len(latencies):>7} ok {len(errors):>5} err {len(latencies) / duration:>8.1f} req/s   "
+        f"p50 {pct(0.50):>8.1f} ms  p95 {pct(0.95):>8.1f} ms  p99 {pct(0.99):>8.1f} ms  "
+        f"max {ordered[-1] * 1000:>8.1f} ms  mean {statistics.fmean(ordered) * 1000:>8.1f} ms"
+    )
+
+
+async def run(args):
+    fast_paths = args.fast_path or ["/anime?limit=20", "/collections", "/stats/db"]
+    counter = 0
+
+    def next_fast():
+        nonlocal counter
+        counter += 1
+        return fast_paths[counter % len(fast_paths)]
+
+    def next_slow():
+        return f"/bangumi/search?query=bench-{uuid.uuid4().hex[:12]}"
+
+    limits = httpx.Limits(max_connections=args.slow + args.fast, max_keepalive_connections=args.slow + args.fast)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        # Warm up connections and caches outside the measured window
+        for path in fast_paths:
+            await client.get(path)
+
+        deadline = time.monotonic() + args.duration
+        fast, fast_errors, slow, slow_errors = [], [], [], []
+        await asyncio.gather(
+            *[_client_loop(client, next_slow, deadline, slow, slow_errors) for _ in range(args.slow)],
+            *[_client_loop(client, next_fast, deadline, fast, fast_errors) for _ in range(args.fast)],
+        )
+
+    print(f"{args.duration:.0f}s, {args.slow} slow clients, {args.fast} fast clients ({', '.join(fast_paths)})")
+    print(_summary("fast", fast, fast_errors, args.duration))
+    print(_summary("slow", slow, slow_errors, args.duration))
+    for message in sorted(set(fast_errors + slow_errors))[:5]:
+        print(f"  error: {message}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    stub = commands.add_parser("stub", help="serve a slow stand-in Bangumi API")
+    stub.add_argument("--host", default="127.0.0.1")
+    stub.add_argument("--port", type=int, default=9100)
+    stub.add_argument("--delay", type=float, default=1.0, help="seconds before every response")
+
+    load = commands.add_parser("run", help="run the mixed workload against the API")
+    load.add_argument("--url", default="http://127.0.0.1:8000")
+    load.add_argument("--duration", type=float, default=20)
+    load.add_argument("--slow", type=int, default=64, help="concurrent GET /bangumi/search clients")
+    load.add_argument("--fast", type=int, default=8, help="concurrent local read clients")
+    load.add_argument("--fast-path", action="append", help="local read path, repeatable")
+    load.add_argument("--timeout", type=float, default=120)
+
+    args = parser.parse_args()
+    if args.command == "stub":
+        import uvicorn
+
+        uvicorn.run(stub_app(args.delay), host=args.host, port=args.port, log_level="warning")
+    else:
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+Serialization microbenchmark for the listing responses: 10k anime rows
+(GET /anime, /collections/{id}/anime) and 10k episode rows with reviews
+(GET /anime/{id}/episodes?include_reviews=true), encoded
+
+  - validated against the response model and dumped by pydantic (what
+    the anime listings did),
+  - validated and encoded the way FastAPI handles a response_model
+    (dump_python + json.dumps, what the episode list did),
+  - straight from the rows with fastjson (stdlib json and orjson).
+
+Every path must produce the same bytes. No database needed:
+
+    python bench_serialization.py --rows 10000 --repeat 5
+"""
+import argparse
+import json
+import random
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from pydantic import TypeAdapter
+
+import fastjson
+from main import _progress_out
+from schemas import AnimeOut, EpisodeWithReviewOut
+
+ANIME_COLUMNS = (
+    "id", "title", "start_date", "total_episodes", "created_at", "source_id", "cover_image_url", "my_score",
+    "main_episodes", "watched_episodes", "avg_episode_score", "last_episode_score", "last_reviewed_at",
+)
+EPISODE_COLUMNS = (
+    "episode_code", "episode_type", "display_order", "title", "air_date",
+    "review_score", "review_comment", "review_reviewed_at", "reviewed",
+)
+
+
+def anime_rows(n: int):
+    rng = random.Random(1)
+    base = datetime(2024, 1, 1)
+    rows = []
+    for i in range(1, n + 1):
+        has_progress = rng.random() < 0.8
+        reviewed = has_progress and rng.random() < 0.6
+        rows.append((
+            i,
+            f"番剧 {i} / Title {i}",
+            date(2000, 1, 1) + timedelta(days=rng.randrange(9000)) if rng.random() < 0.9 else None,
+            rng.choice([12, 13, 24, None]),
+            base + timedelta(seconds=i * 37, microseconds=rng.randrange(1000000)),
+            f"BGM-{100000 + i}",
+            f"https://lain.bgm.tv/pic/cover/l/{i:06d}.jpg",
+            rng.randrange(11) if rng.random() < 0.5 else None,
+            12 if has_progress else None,
+            rng.randrange(13) if has_progress else None,
+            Decimal(f"{rng.uniform(0, 10):.2f}") if reviewed else None,
+            rng.randrange(11) if reviewed else None,
+            base + timedelta(days=rng.randrange(300), seconds=rng.randrange(86400)) if reviewed else None,
+        ))
+    return rows
+
+
+def episode_rows(n: int):
+    rng = random.Random(2)
+    rows = []
+    for i in range(1, n + 1):
+        reviewed = rng.random() < 0.5
+        rows.append((
+            f"E{i:02d}",
+            "main",
+            0,
+            f"第{i}话 「サブタイトル {i}」",
+            date(2020, 1, 1) + timedelta(days=i // 3),
+            rng.randrange(11) if reviewed else None,
+            "不错，节奏很好" if reviewed and rng.random() < 0.5 else None,
+            datetime(2024, 5, 1) + timedelta(seconds=i) if reviewed else None,
+            reviewed,
+        ))
+    return rows
+
+
+# Row mapping, tuple rows the way the endpoints used to do it
+def anime_by_index(rows):
+    return [
+        {
+            "id": r[0], "title": r[1], "start_date": r[2], "total_episodes": r[3], "created_at": r[4],
+            "source_id": r[5], "cover_image_url": r[6], "my_score": r[7],
+            "progress": {
+                "main_episodes": r[8], "watched_episodes": r[9],
+                "avg_episode_score": float(r[10]) if r[10] is not None else None,
+                "last_episode_score": r[11], "last_reviewed_at": r[12],
+            } if r[8] is not None else None,
+        }
+        for r in rows
+    ]
+
+
+def episodes_by_index(rows):
+    return [
+        {
+            "episode_code": r[0], "episode_type": r[1], "display_order": r[2], "title": r[3], "air_date": r[4],
+            "review": {"score": r[5], "comment": r[6], "reviewed_at": r[7]} if r[8] else None,
+        }
+        for r in rows
+    ]
+
+
+# Row mapping on dict rows (psycopg dict_row), as main.list_anime / get_episodes do now
+def anime_from_dict_rows(rows):
+    for row in rows:
+        row["progress"] = _progress_out(row)
+    return rows
+
+
+def episodes_from_dict_rows(rows):
+    for row in rows:
+        review = {
+            "score": row.pop("review_score"),
+            "comment": row.pop("review_comment"),
+            "reviewed_at": row.pop("review_reviewed_at"),
+        }
+        row["review"] = review if row.pop("reviewed") else None
+    return rows
+
+
+def pydantic_dump(adapter):
+    return lambda items: adapter.dump_json(adapter.validate_python(items))
+
+
+def response_model_dump(adapter):
+    # FastAPI: validate against response_model, dump to JSON-able python,
+    # then JSONResponse.render
+    def encode(items):
+        content = adapter.dump_python(adapter.validate_python(items), mode="json")
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+    return encode
+
+
+def fastjson_dump(use_orjson: bool):
+    def encode(items):
+        saved = fastjson.orjson
+        if not use_orjson:
+            fastjson.orjson = None
+        try:
+            return fastjson.dumps(items)
+        finally:
+            fastjson.orjson = saved
+    return encode
+
+
+def best_of(repeat: int, make_rows, mapper, encoder):
+    """Best wall time in ms of mapping + encoding, and the bytes produced."""
+    best = None
+    body = None
+    for _ in range(repeat):
+        rows = make_rows()
+        started = time.perf_counter()
+        body = encoder(mapper(rows))
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, body
+
+
+def bench(name: str, tuples, columns, by_index, from_dict_rows, adapter, repeat: int):
+    def as_tuples():
+        return list(tuples)
+
+    def as_dicts():
+        return [dict(zip(columns, r)) for r in tuples]
+
+    paths = [
+        ("tuple rows, pydantic validate + dump_json", as_tuples, by_index, pydantic_dump(adapter)),
+        ("tuple rows, FastAPI response_model", as_tuples, by_index, response_model_dump(adapter)),
+        ("dict rows, fastjson (stdlib json)", as_dicts, from_dict_rows, fastjson_dump(False)),
+    ]
+    if fastjson.orjson is not None:
+        paths.append(("dict rows, fastjson (orjson)", as_dicts, from_dict_rows, fastjson_dump(True)))
+
+    print(f"{name}: {len(tuples)} rows, best of {repeat}")
+    reference = None
+    baseline = None
+    for label, make_rows, mapper, encoder in paths:
+        elapsed, body = best_of(repeat, make_rows, mapper, encoder)
+        if reference is None:
+            reference, baseline = body, elapsed
+        same = "same bytes" if body == reference else "DIFFERENT OUTPUT"
+        print(f"  {label:<44} {elapsed:>8.1f} ms  {baseline / elapsed:>5.1f}x  {len(body)} B, {same}")
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    bench("anime listing", anime_rows(args.rows), ANIME_COLUMNS, anime_by_index, anime_from_dict_rows,
+          TypeAdapter(list[AnimeOut]), args.repeat)
+    bench("episodes with reviews", episode_rows(args.rows), EPISODE_COLUMNS, episodes_by_index, episodes_from_dict_rows,
+          TypeAdapter(list[EpisodeWithReviewOut]), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,60 @@
-import psycopg
 import os
 from dotenv import load_dotenv
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import AsyncConnectionPool
 
 load_dotenv()
 
 
-def get_conn():
-    return psycopg.connect(
+def _conninfo():
+    return make_conninfo(
         dbname=os.getenv("DB_NAME"),
         user=os.getenv("DB_USER"),
         password=os.getenv("DB_PASSWORD"),
         host=os.getenv("DB_HOST"),
         port=os.getenv("DB_PORT")
-    )
\ No newline at end of file
+    )
+
+
+# Pool sizing / recycling, all overridable from .env
+pool = AsyncConnectionPool(
+    _conninfo(),
+    min_size=int(os.getenv("DB_POOL_MIN_SIZE", "2")),
+    max_size=int(os.getenv("DB_POOL_MAX_SIZE", "10")),
+    max_lifetime=float(os.getenv("DB_POOL_MAX_LIFETIME", "1800")),
+    max_idle=float(os.getenv("DB_POOL_MAX_IDLE", "300")),
+    timeout=float(os.getenv("DB_POOL_TIMEOUT", "10")),
+    # Health check a connection before handing it out, so connections
+    # dropped by the server (restart, idle timeout) never reach a handler.
+    check=AsyncConnectionPool.check_connection,
+    name="myanimetrack",
+    open=False,
+)
+
+
+async def open_pool():
+    await pool.open(wait=True)
+
+
+async def close_pool():
+    await pool.close()
+
+
+def get_conn():
+    """
+    Borrow a connection from the pool.
+
+    Use as an async context manager: the transaction is committed when the block
+    exits normally, rolled back on exception, and the connection goes back
+    to the pool either way.
+    """
+    return pool.connection()
+
+
+def pool_stats():
+    stats = pool.get_stats()
+    stats.update({
+        "max_lifetime": pool.max_lifetime,
+        "max_idle": pool.max_idle,
+    })
+    return stats
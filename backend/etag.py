@@ -0,0 +1,62 @@
+import hashlib
+
+from fastapi import Depends, HTTPException, Request, Response
+
+from db import get_conn
+
+
+# Read endpoints revalidate on every use but may keep a private copy
+CACHE_CONTROL = "private, no-cache"
+
+
+async def table_versions(tables):
+    """
+    Current DataVersion of each table, bumped by triggers when a write
+    that changed rows commits (see migrations/0005_deferred_data_version.sql).
+    Tables never written yet are 0.
+    """
+    async with get_conn() as conn:
+        cur = conn.cursor()
+
+        await cur.execute("""
+            SELECT table_name, version
+            FROM DataVersion
+            WHERE table_name = ANY(%s)
+        """, ([t.lower() for t in tables],))
+        found = dict(await cur.fetchall())
+
+        await cur.close()
+
+    return [found.get(t.lower(), 0) for t in tables]
+
+
+def _matches(if_none_match: str, etag: str):
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, as If-None-Match requires
+    candidates = [c.strip() for c in if_none_match.split(",")]
+    return any(c.removeprefix("W/") == etag for c in candidates)
+
+
+def depends_on(*tables):
+    """
+    Route dependency for reads that only depend on `tables`.
+
+    The ETag is a hash of the request URL and the versions of those
+    tables, so it is looked up before any row is read. A matching
+    If-None-Match is answered with 304 right away and the handler never
+    runs; otherwise the ETag is attached to the normal response.
+    """
+    async def dependency(request: Request, response: Response):
+        versions = await table_versions(tables)
+        key = f"{request.url.path}?{request.url.query}|{versions}"
+        value = '"' + hashlib.sha1(key.encode("utf-8")).hexdigest() + '"'
+        headers = {"ETag": value, "Cache-Control": CACHE_CONTROL}
+
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and _matches(if_none_match, value):
+            raise HTTPException(status_code=304, headers=headers)
+
+        response.headers.update(headers)
+
+    return Depends(dependency)
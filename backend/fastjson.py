@@ -0,0 +1,36 @@
+import json
+from datetime import date, datetime
+
+try:
+    import orjson
+except ImportError:  # optional, the stdlib fallback produces the same bytes
+    orjson = None
+
+
+# JSON encoding for responses built straight from DB rows (and decoding
+# for bulk input). Those rows already have the response model's shape
+# (columns are typed by the schema), so validating them again only costs
+# time; this writes the same JSON pydantic would: naive ISO timestamps,
+# UTF-8, no whitespace.
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content) -> bytes:
+    """
+    Encode dicts / lists of str, int, float, bool, None, date and datetime.
+    Decimals are not handled, cast them to float in the query or row mapping.
+    """
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(data: bytes):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
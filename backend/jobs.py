@@ -0,0 +1,169 @@
+import asyncio
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+
+# Background work (e.g. collection imports) runs as tasks on the event
+# loop, detached from the request that submitted it, so it keeps going if
+# the client disconnects. At most JOB_WORKERS of them run at once.
+_slots = asyncio.Semaphore(int(os.getenv("JOB_WORKERS", "2")))
+# Finished jobs kept around for GET /jobs/{id}
+JOB_HISTORY = int(os.getenv("JOB_HISTORY", "100"))
+
+_jobs = OrderedDict()
+_lock = threading.Lock()
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, kind: str, params: dict):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.params = params
+        self.status = "pending"  # pending / running / completed / failed / cancelled
+        self.progress = {}
+        self.errors = []
+        self.result = None
+        self.error = None
+        self.created_at = datetime.now()
+        self.started_at = None
+        self.finished_at = None
+        # Units of work for the ETA, e.g. items of a collection
+        self.done_units = 0
+        self.total_units = None
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+        self._task = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def update(self, **progress):
+        with self._lock:
+            self.progress.update(progress)
+
+    def increment(self, name: str, amount: int = 1):
+        with self._lock:
+            self.progress[name] = self.progress.get(name, 0) + amount
+
+    def advance(self, done_units: int, total_units: int = None):
+        with self._lock:
+            self.done_units = done_units
+            if total_units is not None:
+                self.total_units = total_units
+
+    def add_error(self, message: str):
+        with self._lock:
+            if len(self.errors) < 20:
+                self.errors.append(message)
+
+    def eta_seconds(self):
+        if self.status != "running" or not self.done_units or not self.total_units:
+            return None
+        elapsed = (datetime.now() - self.started_at).total_seconds()
+        remaining = max(self.total_units - self.done_units, 0)
+        return round(elapsed / self.done_units * remaining, 1)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "id": self.id,
+                "kind": self.kind,
+                "status": self.status,
+                "params": self.params,
+                "progress": dict(self.progress),
+                "done": self.done_units,
+                "total": self.total_units,
+                "eta_seconds": self.eta_seconds(),
+                "errors": list(self.errors),
+                "error": self.error,
+                "result": self.result,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+            }
+
+
+async def _run(job: Job, fn, args):
+    async with _slots:
+        if job.cancelled:
+            job.status = "cancelled"
+            job.finished_at = datetime.now()
+            return
+        job.status = "running"
+        job.started_at = datetime.now()
+        try:
+            job.result = await fn(job, *args)
+            job.status = "completed"
+        except JobCancelled:
+            job.status = "cancelled"
+        except Exception as e:
+            print(f"Job {job.id} ({job.kind}) failed: {e}")
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished_at = datetime.now()
+
+
+def _prune():
+    # Drop the oldest finished jobs beyond JOB_HISTORY (caller holds _lock)
+    finished = [j.id for j in _jobs.values() if j.finished_at is not None]
+    for job_id in finished[:max(len(finished) - JOB_HISTORY, 0)]:
+        del _jobs[job_id]
+
+
+def submit(kind: str, fn, *args, params: dict = None) -> Job:
+    """
+    Run the coroutine function fn(job, *args) as a background task. `fn`
+    reports progress through the job and should call job.check_cancelled()
+    between steps. Must be called from the event loop.
+    """
+    job = Job(kind, params or {})
+    with _lock:
+        _prune()
+        _jobs[job.id] = job
+    job._task = asyncio.create_task(_run(job, fn, args))
+    return job
+
+
+def get(job_id: str):
+    with _lock:
+        return _jobs.get(job_id)
+
+
+def list_jobs():
+    with _lock:
+        return list(reversed(_jobs.values()))
+
+
+def cancel(job_id: str):
+    job = get(job_id)
+    if job and job.finished_at is None:
+        job._cancel.set()
+        if job.status == "pending":
+            # Not started yet; the worker will skip it when it gets there
+            job.status = "cancelled"
+            job.finished_at = datetime.now()
+    return job
+
+
+async def shutdown():
+    # Ask running jobs to stop at their next checkpoint and wait for them,
+    # so they never outlive the DB pool.
+    with _lock:
+        tasks = [job._task for job in _jobs.values() if job._task]
+        for job in _jobs.values():
+            job._cancel.set()
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
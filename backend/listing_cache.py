@@ -0,0 +1,103 @@
+import os
+import threading
+import time
+
+from cache import LRUCache
+
+
+# Serialized responses of the library listings (GET /anime, /collections,
+# /collections/{id}/anime). Keys carry the ETag, i.e. the table versions
+# the body was built for, so a write anywhere makes old entries
+# unreachable; the write endpoints also drop them through tags to free
+# the memory early.
+LISTING_CACHE_ENABLED = os.getenv("LISTING_CACHE_ENABLED", "1") != "0"
+# Bounds how long unreachable entries sit in the cache
+LISTING_CACHE_TTL = float(os.getenv("LISTING_CACHE_TTL", "300"))
+
+_cache = LRUCache(int(os.getenv("LISTING_CACHE_SIZE", "256")))
+
+# Bumped by every invalidation. A read only stores its result if no
+# invalidation happened since it started, so a response built from rows
+# read before a concurrent write can never be cached after it.
+_generation = 0
+_lock = threading.Lock()
+_counters = {"hits": 0, "misses": 0, "stores": 0, "invalidated": 0}
+
+
+def _count(name: str, amount: int = 1):
+    with _lock:
+        _counters[name] += amount
+
+
+def generation():
+    with _lock:
+        return _generation
+
+
+def lookup(key):
+    """(body, headers) for key, or None."""
+    if not LISTING_CACHE_ENABLED:
+        return None
+    entry = _cache.get(key)
+    if entry is None or entry["expires_at"] <= time.time():
+        if entry is not None:
+            _cache.pop(key)
+        _count("misses")
+        return None
+    _count("hits")
+    return entry["body"], entry["headers"]
+
+
+def store(key, started_generation: int, body: bytes, headers: dict, tags):
+    """
+    Store a response built from data read after `started_generation`.
+    `tags` name what it depends on, e.g. "anime", "anime:12", "collection:3".
+    """
+    if not LISTING_CACHE_ENABLED:
+        return
+    with _lock:
+        if started_generation != _generation:
+            return
+        _counters["stores"] += 1
+    _cache.set(key, {
+        "body": body,
+        "headers": headers,
+        "tags": frozenset(tags),
+        "expires_at": time.time() + LISTING_CACHE_TTL,
+    })
+
+
+def invalidate(*tags):
+    """Drop every entry carrying one of `tags`."""
+    global _generation
+    tags = frozenset(tags)
+    with _lock:
+        _generation += 1
+    dropped = 0
+    for key, entry in _cache.items():
+        if entry["tags"] & tags:
+            _cache.pop(key)
+            dropped += 1
+    _count("invalidated", dropped)
+
+
+def clear():
+    global _generation
+    with _lock:
+        _generation += 1
+    _cache.clear()
+
+
+def stats():
+    with _lock:
+        counters = dict(_counters)
+    lookups = counters["hits"] + counters["misses"]
+    return {
+        "enabled": LISTING_CACHE_ENABLED,
+        "ttl": LISTING_CACHE_TTL,
+        "size": len(_cache),
+        "maxsize": _cache.maxsize,
+        "evictions": _cache.evictions,
+        **counters,
+        "hit_rate": round(counters["hits"] / lookups, 4) if lookups else None,
+    }
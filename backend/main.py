@@ -1,14 +1,47 @@
-from fastapi import FastAPI, HTTPException
-from typing import List, Optional
-import requests
-
+from contextlib import asynccontextmanager
+import asyncio
+import base64
+from datetime import date, datetime
+import hashlib
+import json
+import os
+import time
+import unicodedata
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from typing import Annotated, List, Optional
+import httpx
+import psycopg
+from psycopg.rows import dict_row
+
+import bangumi
+import db
+import etag
+import fastjson
+import jobs
+import listing_cache
+import migrations
 from db import get_conn
 
 from schemas import *
 from fastapi.middleware.cors import CORSMiddleware
 
 
-app = FastAPI(title="MyAnimeTrack API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await db.open_pool()
+    if migrations.AUTO_MIGRATE:
+        await migrations.migrate()
+    bangumi.load_cache()
+    try:
+        yield
+    finally:
+        await jobs.shutdown()
+        await bangumi.close()
+        await db.close_pool()
+
+
+app = FastAPI(title="MyAnimeTrack API", lifespan=lifespan)
 
 
 app.add_middleware(
@@ -22,151 +55,335 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
-def sync_bangumi_data(anime_id: int, source_id: str, cur):
+# Page size for /v0/episodes (Bangumi caps it at 200)
+EPISODE_PAGE_SIZE = 200
+# Default number of titles fetched in parallel by POST /anime/sync and
+# collection imports (all of them share the Bangumi rate limiter)
+LIBRARY_SYNC_WORKERS = int(os.getenv("LIBRARY_SYNC_WORKERS", "4"))
+
+
+async def map_limited(fn, items, limit: int):
+    """[await fn(item) for item in items], with at most `limit` calls in flight."""
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(item):
+        async with semaphore:
+            return await fn(item)
+
+    return await asyncio.gather(*(run(item) for item in items))
+
+
+def _parse_date(value):
+    # Bangumi dates are "YYYY-MM-DD", sometimes longer, empty or invalid
+    try:
+        return date.fromisoformat(value[:10]) if value else None
+    except ValueError:
+        return None
+
+
+def _normalize_episode(ep: dict):
+    # Map Bangumi type to system type
+    # 0: 本篇 -> main
+    # 1: SP -> sp
+    # 2: OP -> op
+    # 3: ED -> ed
+    # Other -> trailer/other
+    ep_type_val = ep.get("type")
+    if ep_type_val == 0:
+        ep_type = "main"
+        sort_val = ep.get('sort')
+        try:
+            ep_code = f"E{int(float(sort_val)):02d}"
+        except:
+            ep_code = f"E{sort_val}"
+    elif ep_type_val == 1:
+        ep_type = "sp"
+        ep_code = f"SP{ep.get('sort')}"
+    elif ep_type_val == 2:
+        ep_type = "op"
+        ep_code = f"OP{ep.get('sort')}"
+    elif ep_type_val == 3:
+        ep_type = "ed"
+        ep_code = f"ED{ep.get('sort')}"
+    else:
+        ep_type = "other"
+        ep_code = f"O{ep.get('sort')}"
+
+    title = ep.get("name_cn") or ep.get("name")
+    return {
+        "episode_code": ep_code,
+        "episode_type": ep_type,
+        "title": title[:255] if title else None,
+        "air_date": _parse_date(ep.get("airdate")),
+    }
+
+
+async def fetch_bangumi_data(source_id: str, revalidate: bool = False):
     """
-    Helper function to sync anime details and episodes from Bangumi.
+    Phase 1 of a sync: fetch and normalize the subject's cover and all of
+    its episodes from Bangumi. Network only, so call it without holding a
+    DB connection. With revalidate=True cached responses are revalidated.
+
+    Returns None if source_id is not a Bangumi id. A part that could not be
+    fetched is left as None and skipped by apply_bangumi_data.
     """
     if not source_id or not source_id.startswith("BGM-"):
-        return
+        return None
 
+    bgm_id = source_id.split("-")[1]
+    fetched = {"cover_image_url": None, "episodes": None, "errors": []}
+
+    # 1. Fetch Subject Detail for Cover Image
     try:
-        bgm_id = source_id.split("-")[1]
-        
-        # 1. Fetch Subject Detail for Cover Image (Update only if missing or force sync)
-        try:
-            subject_resp = requests.get(
-                f"https://api.bgm.tv/v0/subjects/{bgm_id}",
-                headers={"User-Agent": "MyAnimeTrack/1.0"},
-                timeout=5
-            )
-            if subject_resp.status_code == 200:
-                subj_data = subject_resp.json()
-                images = subj_data.get("images", {})
-                cover_url = images.get("large") or images.get("common") or images.get("medium")
-                
-                # Update cover image (always update on sync)
-                if cover_url:
-                    cur.execute("""
-                        UPDATE Anime SET cover_image_url = %s WHERE id = %s
-                    """, (cover_url, anime_id))
-        except Exception as e:
-            print(f"Failed to fetch cover image: {e}")
-
-        # 2. Fetch episodes from Bangumi
-        ep_response = requests.get(
-            f"https://api.bgm.tv/v0/episodes",
-            params={"subject_id": bgm_id},
-            headers={"User-Agent": "MyAnimeTrack/1.0"},
-            timeout=10
-        )
-        
-        if ep_response.status_code == 200:
-            ep_data = ep_response.json()
-            episodes_to_insert = []
-            
-            for ep in ep_data.get("data", []):
-                # Map Bangumi type to system type
-                # 0: 本篇 -> main
-                # 1: SP -> sp
-                # 2: OP -> op
-                # 3: ED -> ed
-                # Other -> trailer/other
-                ep_type_val = ep.get("type")
-                if ep_type_val == 0:
-                    ep_type = "main"
-                    sort_val = ep.get('sort')
-                    try:
-                        ep_code = f"E{int(float(sort_val)):02d}"
-                    except:
-                        ep_code = f"E{sort_val}"
-                elif ep_type_val == 1:
-                    ep_type = "sp"
-                    ep_code = f"SP{ep.get('sort')}"
-                elif ep_type_val == 2:
-                    ep_type = "op"
-                    ep_code = f"OP{ep.get('sort')}"
-                elif ep_type_val == 3:
-                    ep_type = "ed"
-                    ep_code = f"ED{ep.get('sort')}"
-                else:
-                    ep_type = "other"
-                    ep_code = f"O{ep.get('sort')}"
-                    
-                episodes_to_insert.append((
-                    anime_id,
-                    ep_code,
-                    ep_type,
-                    0, # display_order not used anymore for sorting
-                    ep.get("name_cn") or ep.get("name"),
-                    ep.get("airdate") or None
-                ))
-            
-            if episodes_to_insert:
-                # Use UPSERT to update existing episodes or insert new ones
-                # Conflict on (anime_id, episode_code)
-                cur.executemany("""
-                    INSERT INTO Episode (
-                        anime_id, episode_code, episode_type, display_order, title, air_date
-                    ) VALUES (%s, %s, %s, %s, %s, %s)
-                    ON CONFLICT (anime_id, episode_code) 
-                    DO UPDATE SET
-                        title = EXCLUDED.title,
-                        air_date = EXCLUDED.air_date
-                """, episodes_to_insert)
+        subj_data = await bangumi.get_subject(bgm_id, timeout=5, revalidate=revalidate)
+        images = subj_data.get("images") or {}
+        fetched["cover_image_url"] = images.get("large") or images.get("common") or images.get("medium")
     except Exception as e:
-        print(f"Failed to sync episodes from Bangumi: {e}")
-        pass
+        print(f"Failed to fetch cover image: {e}")
+        fetched["errors"].append(f"subject: {e}")
 
+    # 2. Fetch all episodes, following /v0/episodes pagination
+    try:
+        episodes = {}
+        offset = 0
+        while True:
+            ep_data = await bangumi.get_episodes(bgm_id, limit=EPISODE_PAGE_SIZE, offset=offset, revalidate=revalidate)
+            page = ep_data.get("data", [])
+            for ep in page:
+                episode = _normalize_episode(ep)
+                episodes[episode["episode_code"]] = episode
+            offset += len(page)
+            if not page or offset >= ep_data.get("total", 0):
+                break
+        fetched["episodes"] = sorted(episodes.values(), key=lambda ep: ep["episode_code"])
+    except Exception as e:
+        print(f"Failed to fetch episodes from Bangumi: {e}")
+        fetched["errors"].append(f"episodes: {e}")
 
-# POST /anime（添加番剧）
-@app.post("/anime", response_model=AnimeOut)
-def create_anime(anime: AnimeCreate):
-    conn = get_conn()
-    cur = conn.cursor()
+    fetched["fingerprint"] = _fingerprint(fetched)
+    return fetched
 
-    try:
-        # Check if exists if source_id is provided
-        if anime.source_id:
-            cur.execute("SELECT id FROM Anime WHERE source_id = %s", (anime.source_id,))
-            if cur.fetchone():
-                raise HTTPException(status_code=409, detail=f"Anime with source_id {anime.source_id} already exists")
 
-        cur.execute("""
-            INSERT INTO Anime (title, start_date, total_episodes, source_id, cover_image_url)
-            VALUES (%s, %s, %s, %s, %s)
-            RETURNING id, title, start_date, total_episodes, created_at, source_id, cover_image_url
+def _fingerprint(fetched: dict):
+    """
+    Content hash of the normalized Bangumi data, stored per anime so an
+    unchanged subject can be skipped. None if part of the fetch failed.
+    """
+    if fetched["errors"] or fetched["episodes"] is None:
+        return None
+    payload = json.dumps(
+        {"cover_image_url": fetched["cover_image_url"], "episodes": fetched["episodes"]},
+        sort_keys=True, ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# Advisory lock namespace (first key of pg_advisory_xact_lock(int, int))
+# serializing refresh_progress per anime
+_PROGRESS_LOCK_KEY = 0x50524F47  # "PROG"
+
+
+async def refresh_progress(cur, anime_ids):
+    """
+    Recompute the AnimeProgress rows of `anime_ids` in one statement.
+    Every field covers main episodes only (SP / OP / ED reviews are not
+    counted), so watched X/Y and the scores describe the same episodes.
+    Call it in the same transaction as any write to their episodes or
+    episode reviews; rows that come out the same are not rewritten.
+
+    Each anime is locked until commit first, so two transactions writing
+    to the same anime aggregate one after the other: the second one waits
+    and then sees the first one's writes, instead of overwriting its
+    progress with a stale aggregate.
+    """
+    anime_ids = sorted(set(anime_ids))
+    if not anime_ids:
+        return
+    # Sorted, so transactions touching overlapping anime lock in the same order
+    await cur.execute("""
+        SELECT pg_advisory_xact_lock(%s, id)
+        FROM (SELECT unnest(%s::int[]) AS id ORDER BY 1) ids
+    """, (_PROGRESS_LOCK_KEY, anime_ids))
+    await cur.execute("""
+        INSERT INTO AnimeProgress AS p (
+            anime_id, main_episodes, watched_episodes, avg_episode_score, last_episode_score, last_reviewed_at
+        )
+        SELECT a.id,
+               count(e.id) FILTER (WHERE e.episode_type = 'main'),
+               count(er.id) FILTER (WHERE e.episode_type = 'main'),
+               round(avg(er.score) FILTER (WHERE e.episode_type = 'main'), 2),
+               (array_agg(er.score ORDER BY er.reviewed_at DESC NULLS LAST, er.id DESC)
+                   FILTER (WHERE er.id IS NOT NULL AND e.episode_type = 'main'))[1],
+               max(er.reviewed_at) FILTER (WHERE e.episode_type = 'main')
+        FROM Anime a
+        LEFT JOIN Episode e ON e.anime_id = a.id
+        LEFT JOIN EpisodeReview er ON er.episode_id = e.id
+        WHERE a.id = ANY(%s)
+        GROUP BY a.id
+        ON CONFLICT (anime_id) DO UPDATE SET
+            main_episodes = EXCLUDED.main_episodes,
+            watched_episodes = EXCLUDED.watched_episodes,
+            avg_episode_score = EXCLUDED.avg_episode_score,
+            last_episode_score = EXCLUDED.last_episode_score,
+            last_reviewed_at = EXCLUDED.last_reviewed_at,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE (p.main_episodes, p.watched_episodes, p.avg_episode_score, p.last_episode_score, p.last_reviewed_at)
+              IS DISTINCT FROM
+              (EXCLUDED.main_episodes, EXCLUDED.watched_episodes, EXCLUDED.avg_episode_score,
+               EXCLUDED.last_episode_score, EXCLUDED.last_reviewed_at)
+    """, (anime_ids,))
+
+
+async def apply_bangumi_data(cur, synced: list):
+    """
+    Phase 2 of a sync: write [(anime_id, fetched), ...] from
+    fetch_bangumi_data, however many titles are in the batch, with one
+    Anime UPDATE and one episode upsert.
+
+    Titles whose stored fingerprint matches are skipped entirely, and
+    only episodes whose fields actually differ are written. Returns the
+    number of changed rows: {"anime": n, "episodes": m}.
+    """
+    synced = [(anime_id, f) for anime_id, f in synced if f]
+    changed = {"anime": 0, "episodes": 0}
+    if not synced:
+        return changed
+
+    # Cover image and fingerprint; matching fingerprints are left alone
+    await cur.execute("""
+        UPDATE Anime a SET
+            cover_image_url = COALESCE(v.cover_image_url, a.cover_image_url),
+            bangumi_fingerprint = v.fingerprint
+        FROM unnest(%s::int[], %s::text[], %s::varchar[]) AS v(id, cover_image_url, fingerprint)
+        WHERE a.id = v.id
+          AND (a.bangumi_fingerprint IS DISTINCT FROM v.fingerprint
+               OR a.cover_image_url IS DISTINCT FROM COALESCE(v.cover_image_url, a.cover_image_url))
+        RETURNING a.id
+    """, (
+        [anime_id for anime_id, _ in synced],
+        [f["cover_image_url"] for _, f in synced],
+        [f["fingerprint"] for _, f in synced],
+    ))
+    updated_ids = {row[0] for row in await cur.fetchall()}
+    changed["anime"] = len(updated_ids)
+
+    # Episodes are only compared for titles that changed (or could not be fingerprinted)
+    episodes = [
+        (anime_id, ep)
+        for anime_id, f in synced
+        if f["episodes"] and (anime_id in updated_ids or f["fingerprint"] is None)
+        for ep in f["episodes"]
+    ]
+    if episodes:
+        # Use UPSERT to insert new episodes and update only the ones that differ
+        # Conflict on (anime_id, episode_code)
+        await cur.execute("""
+            INSERT INTO Episode (
+                anime_id, episode_code, episode_type, display_order, title, air_date
+            )
+            SELECT anime_id, episode_code, episode_type, 0, title, air_date  -- display_order not used anymore for sorting
+            FROM unnest(%s::int[], %s::varchar[], %s::varchar[], %s::varchar[], %s::date[])
+                AS v(anime_id, episode_code, episode_type, title, air_date)
+            ON CONFLICT (anime_id, episode_code) 
+            DO UPDATE SET
+                title = EXCLUDED.title,
+                air_date = EXCLUDED.air_date
+            WHERE (Episode.title, Episode.air_date) IS DISTINCT FROM (EXCLUDED.title, EXCLUDED.air_date)
+            RETURNING anime_id
         """, (
-            anime.title,
-            anime.start_date,
-            anime.total_episodes,
-            anime.source_id,
-            anime.cover_image_url
+            [anime_id for anime_id, _ in episodes],
+            [ep["episode_code"] for _, ep in episodes],
+            [ep["episode_type"] for _, ep in episodes],
+            [ep["title"] for _, ep in episodes],
+            [ep["air_date"] for _, ep in episodes],
         ))
-        
-        row = cur.fetchone()
-        new_anime_id = row[0]
-        
-        # Bangumi Episode Sync Logic (Refactored)
-        if anime.source_id and anime.source_id.startswith("BGM-"):
-            sync_bangumi_data(new_anime_id, anime.source_id, cur)
+        episode_anime_ids = [row[0] for row in await cur.fetchall()]
+        changed["episodes"] = len(episode_anime_ids)
+        await refresh_progress(cur, episode_anime_ids)
 
-        conn.commit()
-        
-        # Retrieve final state (incase sync updated cover)
-        cur.execute("SELECT id, title, start_date, total_episodes, created_at, source_id, cover_image_url FROM Anime WHERE id = %s", (new_anime_id,))
-        final_row = cur.fetchone()
-        
-    except HTTPException as he:
-        conn.rollback()
-        raise he
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        cur.close()
-        conn.close()
+    return changed
+
+
+async def sync_bangumi_data(anime_id: int, source_id: str, revalidate: bool = False):
+    """
+    Helper function to sync anime details and episodes from Bangumi:
+    fetch first, then write in a short transaction of its own.
+    Returns {"changed": row counts, "errors": fetch errors}, or None if
+    source_id is not a Bangumi id.
+    """
+    fetched = await fetch_bangumi_data(source_id, revalidate=revalidate)
+    if fetched is None:
+        return None
+
+    async with get_conn() as conn:
+        cur = conn.cursor()
+        changed = await apply_bangumi_data(cur, [(anime_id, fetched)])
+        await cur.close()
+
+    if any(changed.values()):
+        listing_cache.invalidate(f"anime:{anime_id}", "episodes")
+    return {"changed": changed, "errors": fetched["errors"]}
+
+
+# POST /anime（添加番剧）
+@app.post("/anime", response_model=AnimeOut)
+async def create_anime(anime: AnimeCreate):
+    # Fetch from Bangumi before opening the transaction
+    fetched = await fetch_bangumi_data(anime.source_id)
+
+    async with get_conn() as conn:
+        cur = conn.cursor()
+
+        try:
+            # Check if exists if source_id is provided
+            if anime.source_id:
+                await cur.execute("SELECT id FROM Anime WHERE source_id = %s", (anime.source_id,))
+                if await cur.fetchone():
+                    raise HTTPException(status_code=409, detail=f"Anime with source_id {anime.source_id} already exists")
+
+            await cur.execute("""
+                INSERT INTO Anime (title, start_date, total_episodes, source_id, cover_image_url)
+                VALUES (%s, %s, %s, %s, %s)
+                RETURNING id, title, start_date, total_episodes, created_at, source_id, cover_image_url
+            """, (
+                anime.title,
+                anime.start_date,
+                anime.total_episodes,
+                anime.source_id,
+                anime.cover_image_url
+            ))
+
+            row = await cur.fetchone()
+            new_anime_id = row[0]
+
+            # Bangumi Episode Sync Logic (Refactored)
+            if fetched:
+                await apply_bangumi_data(cur, [(new_anime_id, fetched)])
+            await refresh_progress(cur, [new_anime_id])
+
+            await conn.commit()
+
+            # Retrieve final state (incase sync updated cover)
+            await cur.execute("SELECT id, title, start_date, total_episodes, created_at, source_id, cover_image_url FROM Anime WHERE id = %s", (new_anime_id,))
+            final_row = await cur.fetchone()
+
+        except HTTPException as he:
+            await conn.rollback()
+            raise he
+        except psycopg.errors.UniqueViolation:
+            # Lost a race with a concurrent insert of the same source_id
+            await conn.rollback()
+            raise HTTPException(status_code=409, detail=f"Anime with source_id {anime.source_id} already exists")
+        except Exception as e:
+            await conn.rollback()
+            raise e
+        finally:
+            await cur.close()
+
+    listing_cache.invalidate("anime")
 
     return {
         "id": final_row[0],
@@ -181,7 +398,7 @@ def create_anime(anime: AnimeCreate):
 
 # POST /anime/check_import（检查导入）
 @app.post("/anime/check_import")
-def check_import(data: dict):
+async def check_import(data: dict):
     url_or_id = data.get("url_or_id")
     if not url_or_id:
         return {"error": "Missing input"}
@@ -201,13 +418,12 @@ def check_import(data: dict):
         
     source_id = f"BGM-{bgm_id}"
     
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT id, title FROM Anime WHERE source_id = %s", (source_id,))
-    row = cur.fetchone()
-    cur.close()
-    conn.close()
-    
+    async with get_conn() as conn:
+        cur = conn.cursor()
+        await cur.execute("SELECT id, title FROM Anime WHERE source_id = %s", (source_id,))
+        row = await cur.fetchone()
+        await cur.close()
+
     if row:
         return {
             "exists": True,
@@ -218,10 +434,7 @@ def check_import(data: dict):
     
     # Check if valid on Bangumi
     try:
-        resp = requests.get(f"https://api.bgm.tv/v0/subjects/{bgm_id}", headers={"User-Agent": "MyAnimeTrack/1.0"})
-        if resp.status_code == 404:
-             return {"exists": False, "valid": False, "error": "Bangumi ID not found"}
-        data = resp.json()
+        data = await bangumi.get_subject(bgm_id)
         
         images = data.get("images", {})
         cover_image = images.get("large") or images.get("common")
@@ -235,13 +448,249 @@ def check_import(data: dict):
             "total_episodes": data.get("eps") or data.get("total_episodes"),
             "cover_image_url": cover_image
         }
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code == 404:
+            return {"exists": False, "valid": False, "error": "Bangumi ID not found"}
+        return {"exists": False, "valid": False, "error": "Bangumi API Error"}
     except:
         return {"exists": False, "valid": False, "error": "Bangumi API Error"}
 
 
+def _parse_collection_item(item: dict):
+    """
+    Normalize one entry of /v0/users/{username}/collections into the
+    fields the import writes, truncated / validated to fit the columns.
+    Returns None for entries without a usable subject.
+    """
+    subject = item.get("subject")
+    if not subject or not isinstance(subject.get("id"), int):
+        return None
+
+    title = subject.get("name_cn") or subject.get("name")
+    if not title:
+        return None
+
+    total_episodes = subject.get("eps") or subject.get("total_episodes")
+    if not isinstance(total_episodes, int):
+        total_episodes = None
+
+    images = subject.get("images") or {}
+
+    # Extract Rating and Comment, out of range scores are dropped
+    score = item.get("rate")
+    if not isinstance(score, int) or not 0 <= score <= 10:
+        score = None
+    imported_comment = item.get("comment")
+    if not isinstance(imported_comment, str) or not imported_comment.strip():
+        imported_comment = None
+
+    return {
+        "source_id": f"BGM-{subject.get('id')}",
+        "title": title[:255],
+        "start_date": _parse_date(subject.get("date")),
+        "total_episodes": total_episodes,
+        "cover_image_url": images.get("large") or images.get("common"),
+        "score": score,
+        "comment": imported_comment,
+    }
+
+
+async def import_collection_page(cur, entries: list):
+    """
+    Write one page of parsed collection entries with a fixed number of
+    statements: one lookup, one multi-row insert of the new Anime rows and
+    one merge into AnimeReview. Returns (anime ids by source_id, added, updated).
+    """
+    # Later duplicates of the same subject win, like row-by-row processing
+    entries = list({e["source_id"]: e for e in entries}.values())
+
+    await cur.execute(
+        "SELECT source_id, id FROM Anime WHERE source_id = ANY(%s)",
+        ([e["source_id"] for e in entries],)
+    )
+    anime_ids = dict(await cur.fetchall())
+
+    new_entries = [e for e in entries if e["source_id"] not in anime_ids]
+    added = 0
+    if new_entries:
+        await cur.execute("""
+            INSERT INTO Anime (title, start_date, total_episodes, source_id, cover_image_url)
+            SELECT * FROM unnest(%s::varchar[], %s::date[], %s::int[], %s::varchar[], %s::text[])
+            ON CONFLICT (source_id) DO NOTHING
+            RETURNING source_id, id
+        """, (
+            [e["title"] for e in new_entries],
+            [e["start_date"] for e in new_entries],
+            [e["total_episodes"] for e in new_entries],
+            [e["source_id"] for e in new_entries],
+            [e["cover_image_url"] for e in new_entries],
+        ))
+        inserted = dict(await cur.fetchall())
+        anime_ids.update(inserted)
+        added = len(inserted)
+        # Every anime has a progress row, even before any episode is synced
+        await refresh_progress(cur, inserted.values())
+
+        # Inserted concurrently since the lookup above
+        raced = [e["source_id"] for e in new_entries if e["source_id"] not in inserted]
+        if raced:
+            await cur.execute("SELECT source_id, id FROM Anime WHERE source_id = ANY(%s)", (raced,))
+            anime_ids.update(await cur.fetchall())
+
+    # Handle ReviewSync (Do not overwrite valid local data): a local score
+    # > 0 and a non-blank local comment win over the imported values.
+    reviews = [e for e in entries if e["score"] or e["comment"]]
+    if reviews:
+        await cur.execute("""
+            INSERT INTO AnimeReview AS ar (anime_id, score, comment)
+            SELECT * FROM unnest(%s::int[], %s::int[], %s::text[])
+            ON CONFLICT (anime_id) DO UPDATE SET
+                score = CASE WHEN ar.score > 0 THEN ar.score ELSE EXCLUDED.score END,
+                comment = CASE WHEN btrim(ar.comment, E' \\t\\r\\n') <> '' THEN ar.comment ELSE EXCLUDED.comment END
+            WHERE (CASE WHEN ar.score > 0 THEN ar.score ELSE EXCLUDED.score END) IS DISTINCT FROM ar.score
+               OR (CASE WHEN btrim(ar.comment, E' \\t\\r\\n') <> '' THEN ar.comment ELSE EXCLUDED.comment END) IS DISTINCT FROM ar.comment
+        """, (
+            [anime_ids[e["source_id"]] for e in reviews],
+            [e["score"] for e in reviews],
+            [e["comment"] for e in reviews],
+        ))
+
+    return anime_ids, added, len(entries) - added
+
+
+async def _load_import_checkpoint(username: str, collection_type: int):
+    async with get_conn() as conn:
+        cur = conn.cursor()
+        await cur.execute("""
+            SELECT next_offset, completed
+            FROM ImportCheckpoint
+            WHERE username = %s AND collection_type = %s
+        """, (username, collection_type))
+        row = await cur.fetchone()
+        await cur.close()
+    return row
+
+
+async def _save_import_checkpoint(cur, username: str, collection_type: int, next_offset: int, total: int, completed: bool):
+    await cur.execute("""
+        INSERT INTO ImportCheckpoint (username, collection_type, next_offset, total, completed)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (username, collection_type)
+        DO UPDATE SET
+            next_offset = EXCLUDED.next_offset,
+            total = EXCLUDED.total,
+            completed = EXCLUDED.completed,
+            updated_at = CURRENT_TIMESTAMP
+    """, (username, collection_type, next_offset, total, completed))
+
+
+async def _write_collection_entries(cur, entries: list, fetched: dict):
+    """
+    Write parsed collection entries and their prefetched Bangumi data.
+    Returns (anime ids by source_id, added, updated, episodes changed).
+    """
+    anime_ids, added, updated = await import_collection_page(cur, entries)
+    changed = await apply_bangumi_data(cur, [
+        (anime_id, fetched[source_id]) for source_id, anime_id in anime_ids.items()
+    ])
+    return anime_ids, added, updated, changed["episodes"]
+
+
+async def run_collection_import(job, username: str, collection_type: int, resume: bool = True):
+    """
+    Background job body for POST /bangumi/import_collection.
+
+    Pages through the whole list. Each page is written in its own
+    transaction together with a checkpoint (username, type, next offset),
+    so a failed or cancelled import resumes from the first page that was
+    not committed instead of starting over. Rows the database rejects are
+    skipped and counted as failed, they don't hold the page back.
+    """
+    limit = 50
+    offset = 0
+    if resume:
+        checkpoint = await _load_import_checkpoint(username, collection_type)
+        if checkpoint and not checkpoint[1]:
+            offset = checkpoint[0]
+    start_offset = offset
+    pages_done = 0
+    job.update(start_offset=offset, offset=offset, pages_done=0, pages_total=None, added=0, updated=0, failed=0, episodes_changed=0)
+
+    while True:
+        job.check_cancelled()
+        data = await bangumi.get_user_collections(username, collection_type, limit, offset)
+
+        items = data.get("data", [])
+        total = data.get("total", 0)
+        next_offset = offset + len(items)
+        completed = not items or next_offset >= total
+
+        entries = [e for e in map(_parse_collection_item, items) if e]
+
+        # Fetch every title's Bangumi data before the page transaction opens
+        source_ids = [entry["source_id"] for entry in entries]
+        fetched = dict(zip(source_ids, await map_limited(fetch_bangumi_data, source_ids, LIBRARY_SYNC_WORKERS)))
+        job.check_cancelled()
+
+        async with get_conn() as conn:
+            cur = conn.cursor()
+            # Saved first, so the page transaction is open for the savepoints below
+            await _save_import_checkpoint(cur, username, collection_type, next_offset, total, completed)
+
+            anime_ids = {}
+            added = updated = failed = episodes_changed = 0
+            if entries:
+                try:
+                    # Savepoint: if the page fails as a whole, redo it row by row
+                    async with conn.transaction():
+                        anime_ids, added, updated, episodes_changed = await _write_collection_entries(cur, entries, fetched)
+                except (psycopg.errors.DataError, psycopg.errors.IntegrityError) as e:
+                    print(f"Collection page at offset {offset} failed, retrying row by row: {e}")
+                    for entry in entries:
+                        try:
+                            async with conn.transaction():
+                                ids, entry_added, entry_updated, entry_changed = await _write_collection_entries(
+                                    cur, [entry], fetched
+                                )
+                        except (psycopg.errors.DataError, psycopg.errors.IntegrityError) as e:
+                            failed += 1
+                            job.add_error(f"{entry['source_id']} ({entry['title']}): {e}")
+                            continue
+                        anime_ids.update(ids)
+                        added += entry_added
+                        updated += entry_updated
+                        episodes_changed += entry_changed
+
+            await cur.close()
+
+        if anime_ids:
+            listing_cache.invalidate("anime", "score", "episodes", *[f"anime:{anime_id}" for anime_id in anime_ids.values()])
+
+        pages_done += 1
+        job.increment("added", added)
+        job.increment("updated", updated)
+        job.increment("episodes_changed", episodes_changed)
+        job.increment("failed", len(items) - len(entries) + failed)
+        job.update(offset=next_offset, pages_done=pages_done, pages_total=-(-(total - start_offset) // limit))
+        job.advance(next_offset - start_offset, total - start_offset)
+
+        if completed:
+            break
+        offset = next_offset
+
+    progress = job.to_dict()["progress"]
+    return {
+        "status": "ok",
+        "added": progress["added"],
+        "updated": progress["updated"],
+        "failed": progress["failed"],
+        "message": f"Successfully imported: {progress['added']} added, {progress['updated']} updated."
+    }
+
+
 # POST /bangumi/import_collection（批量导入）
 @app.post("/bangumi/import_collection")
-def import_collection(data: dict):
+async def import_collection(data: dict):
     url = data.get("url")
     if not url:
         return {"error": "Missing URL"}
@@ -273,390 +722,827 @@ def import_collection(data: dict):
     except Exception as e:
         return {"error": f"Failed to parse URL: {e}"}
 
-    # Fetch User Collection
-    try:
-        # Fetching first 50 items for now. 
-        # Ideally should loop with offset until empty, but let's start safe.
-        limit = 50
-        offset = 0
-        added_count = 0
-        updated_count = 0
-        failed_count = 0
-        
-        conn = get_conn()
-        cur = conn.cursor()
-        
-        # We might need to pagination loop here
-        # For this iteration, let's just do one page or two.
-        
-        while True:
-            resp = requests.get(
-                f"https://api.bgm.tv/v0/users/{username}/collections",
-                params={
-                    "subject_type": 2, # Anime
-                    "type": collection_type,
-                    "limit": limit,
-                    "offset": offset
-                },
-                headers={"User-Agent": "MyAnimeTrack/1.0"},
-                timeout=15
-            )
-            
-            if resp.status_code != 200:
-                break
-                
-            data = resp.json()
-            items = data.get("data", [])
-            if not items:
-                break
-                
-            for item in items:
-                try:
-                    subject = item.get("subject")
-                    if not subject:
-                        continue
-                        
-                    bgm_id = subject.get("id")
-                    source_id = f"BGM-{bgm_id}"
-                    
-                    # Extract Rating and Comment
-                    imported_score = item.get("rate")
-                    imported_comment = item.get("comment")
-                    if imported_comment and not imported_comment.strip():
-                        imported_comment = None
-                    
-                    # Check DB
-                    cur.execute("SELECT id FROM Anime WHERE source_id = %s", (source_id,))
-                    row = cur.fetchone()
-                    
-                    anime_id = None
-                    if row:
-                        # EXISTS -> Update
-                        anime_id = row[0]
-                        sync_bangumi_data(anime_id, source_id, cur)
-                        updated_count += 1
-                    else:
-                        # NEW -> Insert
-                        title = subject.get("name_cn") or subject.get("name")
-                        start_date = subject.get("date")
-                        # Truncate date if needed
-                        if start_date and len(start_date) > 10: start_date = start_date[:10]
-                        
-                        eps = subject.get("eps") or subject.get("total_episodes")
-                        
-                        images = subject.get("images", {})
-                        cover = images.get("large") or images.get("common")
-                        
-                        cur.execute("""
-                            INSERT INTO Anime (title, start_date, total_episodes, source_id, cover_image_url)
-                            VALUES (%s, %s, %s, %s, %s)
-                            RETURNING id
-                        """, (title, start_date, eps, source_id, cover))
-                        
-                        anime_id = cur.fetchone()[0]
-                        sync_bangumi_data(anime_id, source_id, cur)
-                        added_count += 1
-                    
-                    # Handle ReviewSync (Do not overwrite valid local data)
-                    if anime_id and (imported_score or imported_comment):
-                        cur.execute("SELECT score, comment FROM AnimeReview WHERE anime_id = %s", (anime_id,))
-                        review_row = cur.fetchone()
-                        
-                        if not review_row:
-                            # No review exists, safe to insert both
-                            cur.execute("""
-                                INSERT INTO AnimeReview (anime_id, score, comment)
-                                VALUES (%s, %s, %s)
-                            """, (anime_id, imported_score, imported_comment))
-                        else:
-                            # Review exists, check what is missing
-                            local_score, local_comment = review_row
-                            
-                            new_score = local_score if (local_score is not None and local_score > 0) else imported_score
-                            new_comment = local_comment if (local_comment and local_comment.strip()) else imported_comment
-                            
-                            # Update if we have something new to add (and it's different)
-                            if (new_score != local_score) or (new_comment != local_comment):
-                                cur.execute("""
-                                    UPDATE AnimeReview 
-                                    SET score = %s, comment = %s
-                                    WHERE anime_id = %s
-                                """, (new_score, new_comment, anime_id))
-
-                except Exception as e:
-                    print(f"Error importing item: {e}")
-                    failed_count += 1
-                    
-            offset += limit
-            if offset >= data.get("total", 0) or offset > 200: # Safety break at 200
-                break
-                
-        conn.commit()
-        cur.close()
-        conn.close()
-        
-        return {
-            "status": "ok",
-            "added": added_count,
-            "updated": updated_count,
-            "failed": failed_count,
-            "message": f"Successfully imported: {added_count} added, {updated_count} updated."
-        }
-        
-    except Exception as e:
-        return {"error": f"Import failed: {e}"}
+    # Continue an unfinished earlier import of the same list unless asked not to
+    resume = bool(data.get("resume", True))
+
+    job = jobs.submit(
+        "import_collection",
+        run_collection_import,
+        username,
+        collection_type,
+        resume,
+        params={"url": url, "username": username, "type": type_str, "resume": resume}
+    )
+    return job.to_dict()
 
 
 # POST /anime/{id}/sync（原地更新）
 @app.post("/anime/{anime_id}/sync")
-def sync_anime(anime_id: int):
-    conn = get_conn()
-    cur = conn.cursor()
-    
-    cur.execute("SELECT source_id FROM Anime WHERE id = %s", (anime_id,))
-    row = cur.fetchone()
+async def sync_anime(anime_id: int):
+    async with get_conn() as conn:
+        cur = conn.cursor()
+
+        await cur.execute("SELECT source_id FROM Anime WHERE id = %s", (anime_id,))
+        row = await cur.fetchone()
+        await cur.close()
+
     if not row or not row[0]:
-        cur.close()
-        conn.close()
         raise HTTPException(status_code=400, detail="Anime has no source_id to sync from")
-        
-    source_id = row[0]
-    
+
+    # The connection is back in the pool while Bangumi is being fetched
+    result = await sync_bangumi_data(anime_id, row[0], revalidate=True)
+    changed = result["changed"] if result else {"anime": 0, "episodes": 0}
+
+    return {
+        "status": "ok",
+        "changed": changed,
+        "unchanged": not any(changed.values()),
+        "errors": result["errors"] if result else []
+    }
+
+
+async def _sync_library_title(target, revalidate: bool):
+    anime_id, title, source_id = target
+    outcome = {"anime_id": anime_id, "title": title, "source_id": source_id}
     try:
-        sync_bangumi_data(anime_id, source_id, cur)
-        conn.commit()
+        result = await sync_bangumi_data(anime_id, source_id, revalidate=revalidate)
     except Exception as e:
-        conn.rollback()
-        raise e
+        return {**outcome, "status": "failed", "changed": None, "errors": [str(e)]}
+
+    changed = result["changed"]
+    if result["errors"] and not any(changed.values()):
+        status = "failed"
+    elif any(changed.values()):
+        status = "updated"
+    else:
+        status = "unchanged"
+    return {**outcome, "status": status, "changed": changed, "errors": result["errors"]}
+
+
+async def run_library_sync(job, targets: list, concurrency: int, revalidate: bool):
+    """
+    Re-sync many titles through sync_bangumi_data, `concurrency` at a
+    time. `job` is None when running inline in a request.
+    """
+    started = time.monotonic()
+    results = []
+    if job:
+        job.advance(0, len(targets))
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def sync_one(target):
+        async with semaphore:
+            return await _sync_library_title(target, revalidate)
+
+    tasks = [asyncio.create_task(sync_one(target)) for target in targets]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            results.append(await next_done)
+            if job:
+                job.increment(results[-1]["status"])
+                job.advance(len(results))
+                job.check_cancelled()
     finally:
-        cur.close()
-        conn.close()
-        
-    return {"status": "ok"}
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    counts = {"updated": 0, "unchanged": 0, "failed": 0}
+    for outcome in results:
+        counts[outcome["status"]] += 1
+
+    order = {target[0]: index for index, target in enumerate(targets)}
+    results.sort(key=lambda outcome: order[outcome["anime_id"]])
+    return {
+        "status": "ok",
+        "total": len(targets),
+        **counts,
+        "elapsed_seconds": round(time.monotonic() - started, 3),
+        "results": results
+    }
+
+
+# POST /anime/sync（批量同步整个番剧库）
+@app.post("/anime/sync")
+async def sync_library(req: LibrarySyncRequest = LibrarySyncRequest()):
+    conditions = ["a.source_id LIKE 'BGM-%%'"]
+    params = []
+    if req.collection_id is not None:
+        conditions.append("EXISTS (SELECT 1 FROM CollectionAnime ca WHERE ca.anime_id = a.id AND ca.collection_id = %s)")
+        params.append(req.collection_id)
+    if req.source_id_prefix:
+        conditions.append("starts_with(a.source_id, %s)")
+        params.append(req.source_id_prefix)
+    if req.aired_within_days is not None:
+        conditions.append("""EXISTS (
+            SELECT 1 FROM Episode e
+            WHERE e.anime_id = a.id AND e.air_date BETWEEN CURRENT_DATE - %s AND CURRENT_DATE
+        )""")
+        params.append(req.aired_within_days)
+
+    async with get_conn() as conn:
+        cur = conn.cursor()
+        await cur.execute(f"""
+            SELECT a.id, a.title, a.source_id
+            FROM Anime a
+            WHERE {" AND ".join(conditions)}
+            ORDER BY a.id
+        """, params)
+        targets = await cur.fetchall()
+        await cur.close()
+
+    concurrency = req.concurrency or LIBRARY_SYNC_WORKERS
+    if req.background:
+        job = jobs.submit(
+            "library_sync",
+            run_library_sync,
+            targets,
+            concurrency,
+            req.revalidate,
+            params=req.model_dump()
+        )
+        return job.to_dict()
+
+    return await run_library_sync(None, targets, concurrency, req.revalidate)
 
 
 # DELETE /anime/{anime_id}（删除番剧）
 @app.delete("/anime/{anime_id}")
-def delete_anime(anime_id: int):
-    conn = get_conn()
-    cur = conn.cursor()
-    
-    try:
-        cur.execute("""
-            DELETE FROM EpisodeReview
-            WHERE episode_id IN (SELECT id FROM Episode WHERE anime_id = %s)
-        """, (anime_id,))
-        cur.execute("DELETE FROM Episode WHERE anime_id = %s", (anime_id,))
-        cur.execute("DELETE FROM AnimeReview WHERE anime_id = %s", (anime_id,))
-        cur.execute("DELETE FROM CollectionAnime WHERE anime_id = %s", (anime_id,))
-        cur.execute("DELETE FROM Anime WHERE id = %s", (anime_id,))
-        
-        if cur.rowcount == 0:
-            raise HTTPException(status_code=404, detail="Anime not found")
-            
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        cur.close()
-        conn.close()
+async def delete_anime(anime_id: int):
+    async with get_conn() as conn:
+        cur = conn.cursor()
+
+        # Episodes, reviews and collection memberships go with it (ON DELETE CASCADE)
+        await cur.execute("DELETE FROM Anime WHERE id = %s", (anime_id,))
+        deleted = cur.rowcount
+
+        await cur.close()
+
+    if deleted == 0:
+        raise HTTPException(status_code=404, detail="Anime not found")
+
+    listing_cache.invalidate("anime", f"anime:{anime_id}")
         
     return {"status": "ok"}
 
 
+# POST /anime/delete（批量删除番剧）
+@app.post("/anime/delete")
+async def delete_anime_bulk(data: AnimeBulkDelete):
+    async with get_conn() as conn:
+        cur = conn.cursor()
+
+        await cur.execute("DELETE FROM Anime WHERE id = ANY(%s) RETURNING id", (data.ids,))
+        deleted = sorted(row[0] for row in await cur.fetchall())
+
+        await cur.close()
+
+    if deleted:
+        listing_cache.invalidate("anime", *[f"anime:{anime_id}" for anime_id in deleted])
+
+    return {
+        "status": "ok",
+        "deleted": deleted,
+        "not_found": sorted(set(data.ids) - set(deleted)),
+    }
+
+
+# Sort keys for anime listings: the SQL expression, with NULLs mapped to a
+# sentinel so keyset comparisons stay total, and the cursor value parser.
+# Unknown start dates sort as the latest, missing scores as the lowest.
+# The Anime columns have a matching (expression, id) index, see
+# migrations/0001_baseline.sql. The score sort spans the AnimeReview join
+# and has none, so it sorts the filtered rows on every page
+# (animereview_score_idx only serves the score filters).
+ANIME_SORTS = {
+    "created_at": ("COALESCE(a.created_at, TIMESTAMP '1970-01-01')", datetime.fromisoformat),
+    "score": ("COALESCE(ar.score, -1)", int),
+    "start_date": ("COALESCE(a.start_date, DATE '9999-12-31')", date.fromisoformat),
+    "title": ("a.title", str),
+}
+SEASON_MONTHS = {"winter": 1, "spring": 4, "summer": 7, "fall": 10}
+
+
+def _encode_cursor(sort_value, anime_id: int):
+    payload = json.dumps([sort_value, anime_id], default=str)
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor: str, parse):
+    try:
+        sort_value, anime_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return parse(sort_value), int(anime_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+PROGRESS_COLUMNS = ("main_episodes", "watched_episodes", "avg_episode_score", "last_episode_score", "last_reviewed_at")
+
+
+def _progress_out(row: dict):
+    """
+    Pop the AnimeProgress columns off a row into an AnimeProgressOut dict,
+    None if the anime has no progress row yet.
+    """
+    progress = {name: row.pop(name) for name in PROGRESS_COLUMNS}
+    if progress["main_episodes"] is None:
+        return None
+    if progress["avg_episode_score"] is not None:
+        progress["avg_episode_score"] = float(progress["avg_episode_score"])
+    return progress
+
+
+def _pop_review(row: dict):
+    """
+    Pop the review_score / review_comment / review_reviewed_at / reviewed
+    columns off a row into a review dict, None if there is no review.
+    """
+    review = {
+        "score": row.pop("review_score"),
+        "comment": row.pop("review_comment"),
+        "reviewed_at": row.pop("review_reviewed_at"),
+    }
+    return review if row.pop("reviewed") else None
+
+
+async def list_anime(params: AnimeListQuery, collection_id: int = None):
+    """
+    One page of anime rows (AnimeOut dicts) in params.sort order, keyset
+    paginated on (sort expression, id), and the cursor of the next page
+    (None on the last one). Columns are aliased to the AnimeOut fields,
+    in field order, so the rows can be encoded as they are.
+    """
+    sort_expr, parse = ANIME_SORTS[params.sort]
+    direction = "DESC" if params.order == "desc" else "ASC"
+
+    joins = []
+    where = []
+    args = []
+
+    if collection_id is not None:
+        joins.append("JOIN CollectionAnime ca ON a.id = ca.anime_id")
+        where.append("ca.collection_id = %s")
+        args.append(collection_id)
+
+    if params.min_score is not None:
+        where.append("ar.score >= %s")
+        args.append(params.min_score)
+    if params.max_score is not None:
+        where.append("ar.score <= %s")
+        args.append(params.max_score)
+    if params.reviewed is not None:
+        where.append("ar.id IS NOT NULL" if params.reviewed else "ar.id IS NULL")
+
+    if params.year is not None:
+        # Plain range on start_date so the index can be used
+        first_month, months = (SEASON_MONTHS[params.season], 3) if params.season else (1, 12)
+        start = date(params.year, first_month, 1)
+        end_month = first_month + months
+        end = date(params.year + 1, 1, 1) if end_month > 12 else date(params.year, end_month, 1)
+        where.append("a.start_date >= %s AND a.start_date < %s")
+        args.extend([start, end])
+    elif params.season:
+        where.append("EXTRACT(MONTH FROM a.start_date) BETWEEN %s AND %s")
+        args.extend([SEASON_MONTHS[params.season], SEASON_MONTHS[params.season] + 2])
+
+    if params.episode_type:
+        where.append("EXISTS (SELECT 1 FROM Episode e WHERE e.anime_id = a.id AND e.episode_type = %s)")
+        args.append(params.episode_type)
+
+    if params.cursor:
+        where.append(f"({sort_expr}, a.id) {'<' if direction == 'DESC' else '>'} (%s, %s)")
+        args.extend(_decode_cursor(params.cursor, parse))
+
+    async with get_conn() as conn:
+        cur = conn.cursor(row_factory=dict_row)
+
+        # One extra row tells whether there is a next page
+        await cur.execute(f"""
+            SELECT a.id, a.title, a.start_date, a.total_episodes, a.created_at, a.source_id, a.cover_image_url,
+                   ar.score AS my_score,
+                   p.main_episodes, p.watched_episodes, p.avg_episode_score, p.last_episode_score, p.last_reviewed_at,
+                   {sort_expr} AS sort_value
+            FROM Anime a
+            {" ".join(joins)}
+            LEFT JOIN AnimeReview ar ON a.id = ar.anime_id
+            LEFT JOIN AnimeProgress p ON a.id = p.anime_id
+            {"WHERE " + " AND ".join(where) if where else ""}
+            ORDER BY {sort_expr} {direction}, a.id {direction}
+            LIMIT %s
+        """, (*args, params.limit + 1))
+        rows = await cur.fetchall()
+
+        await cur.close()
+
+    next_cursor = None
+    if len(rows) > params.limit:
+        rows = rows[:params.limit]
+        next_cursor = _encode_cursor(rows[-1]["sort_value"], rows[-1]["id"])
+
+    for row in rows:
+        del row["sort_value"]
+        row["progress"] = _progress_out(row)
+    return rows, next_cursor
+
+
+def json_response(response: Response, body: bytes, headers: dict = None):
+    """
+    Response for a body encoded with fastjson. Returning a Response skips
+    response_model, so the ETag headers the dependency set on `response`
+    are carried over here.
+    """
+    return Response(content=body, media_type="application/json", headers={**response.headers, **(headers or {})})
+
+
+async def cached_listing(request: Request, response: Response, build):
+    """
+    Serve a listing from listing_cache, or build and cache it.
+
+    await build() returns (body, extra headers, cache tags); see listing_cache
+    for the tags the write endpoints invalidate.
+
+    The key includes the ETag the etag dependency computed from the
+    current table versions, so once any of those tables changes (through
+    the API or not) old entries are never served again, and the ETag sent
+    always belongs to a body built after that version.
+    """
+    key = f"{request.url.path}?{request.url.query}|{response.headers.get('ETag')}"
+    cached = listing_cache.lookup(key)
+    if cached:
+        body, headers = cached
+    else:
+        started = listing_cache.generation()
+        body, headers, tags = await build()
+        listing_cache.store(key, started, body, headers, tags)
+    return json_response(response, body, headers)
+
+
+async def _anime_listing(params: AnimeListQuery, collection_id: int = None):
+    items, next_cursor = await list_anime(params, collection_id)
+    tags = ["anime"] if collection_id is None else [f"collection:{collection_id}"]
+    tags += [f"anime:{a['id']}" for a in items]
+    # Which rows are listed can also change with reviews / episodes
+    if params.sort == "score" or params.min_score is not None or params.max_score is not None or params.reviewed is not None:
+        tags.append("score")
+    if params.episode_type:
+        tags.append("episodes")
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    return fastjson.dumps(items), headers, tags
+
+
 # GET /anime（查询番剧）
-@app.get("/anime", response_model=List[AnimeOut])
-def get_anime():
-    conn = get_conn()
-    cur = conn.cursor()
+@app.get("/anime", response_model=List[AnimeOut], dependencies=[etag.depends_on("Anime", "AnimeReview", "Episode", "AnimeProgress")])
+async def get_anime(request: Request, response: Response, params: Annotated[AnimeListQuery, Query()]):
+    return await cached_listing(request, response, lambda: _anime_listing(params))
 
-    cur.execute("""
-        SELECT a.id, a.title, a.start_date, a.total_episodes, a.created_at, a.source_id, a.cover_image_url, ar.score
-        FROM Anime a
-        LEFT JOIN AnimeReview ar ON a.id = ar.anime_id
-        ORDER BY a.created_at DESC
-    """)
-    rows = cur.fetchall()
-
-    cur.close()
-    conn.close()
-
-    return [
-        {
-            "id": r[0],
-            "title": r[1],
-            "start_date": r[2],
-            "total_episodes": r[3],
-            "created_at": r[4],
-            "source_id": r[5],
-            "cover_image_url": r[6],
-            "my_score": r[7]
-        }
-        for r in rows
-    ]
+
+_trgm_available = None
+
+
+async def trgm_available():
+    """Whether pg_trgm is installed (see migrations/0003_library_search.sql)."""
+    global _trgm_available
+    if _trgm_available is None:
+        async with get_conn() as conn:
+            cur = conn.cursor()
+            await cur.execute("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')")
+            _trgm_available = (await cur.fetchone())[0]
+            await cur.close()
+    return _trgm_available
+
+
+def _escape_like(text: str):
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+# GET /anime/search（搜索本地番剧库）
+@app.get(
+    "/anime/search",
+    response_model=AnimeSearchOut,
+    dependencies=[etag.depends_on("Anime", "AnimeReview", "Episode", "EpisodeReview")],
+)
+async def search_anime(
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+):
+    """
+    Search anime titles, episode titles and review comments.
+
+    Substring matching (ILIKE) works for any script. Candidates come from
+    the character n-gram indexes (migrations/0007_search_bigrams.sql), so
+    one- or two-character CJK queries are index backed too. With pg_trgm
+    installed, queries of three or more characters also find near matches
+    by word similarity. Each anime is ranked by its best match per field,
+    titles weighing the most.
+    """
+    q = unicodedata.normalize("NFKC", q).strip()
+    if not q:
+        raise HTTPException(status_code=422, detail="Empty query")
+
+    # Word similarity means little for one or two characters, and pg_trgm
+    # can't index it there
+    trgm = len(q) >= 3 and await trgm_available()
+
+    def match(column):
+        substring = f"search_grams({column}) @> search_query_grams(%(q)s) AND {column} ILIKE %(pattern)s"
+        if trgm:
+            return f"(({substring}) OR %(q)s <%% {column})"
+        return substring
+
+    def rank(column, weight):
+        similarity = f" + word_similarity(%(q)s, {column})" if trgm else ""
+        return f"{weight} * ((CASE WHEN {column} ILIKE %(pattern)s THEN 1 ELSE 0 END){similarity})"
+
+    async with get_conn() as conn:
+        cur = conn.cursor()
+
+        await cur.execute(f"""
+            WITH matches AS (
+                SELECT a.id AS anime_id, 'title' AS field,
+                       {rank("a.title", 3)}
+                       + CASE WHEN lower(a.title) = lower(%(q)s) THEN 1
+                              WHEN a.title ILIKE %(prefix)s THEN 0.5
+                              ELSE 0 END AS rank
+                FROM Anime a
+                WHERE {match("a.title")}
+                UNION ALL
+                SELECT e.anime_id, 'episode', {rank("e.title", 1)}
+                FROM Episode e
+                WHERE {match("e.title")}
+                UNION ALL
+                SELECT ar.anime_id, 'comment', {rank("ar.comment", 1)}
+                FROM AnimeReview ar
+                WHERE {match("ar.comment")}
+                UNION ALL
+                SELECT e.anime_id, 'comment', {rank("er.comment", 1)}
+                FROM EpisodeReview er
+                JOIN Episode e ON e.id = er.episode_id
+                WHERE {match("er.comment")}
+            ),
+            per_field AS (
+                SELECT anime_id, field, max(rank) AS rank
+                FROM matches
+                GROUP BY anime_id, field
+            ),
+            ranked AS (
+                SELECT anime_id, sum(rank)::float8 AS rank, array_agg(field ORDER BY field) AS fields
+                FROM per_field
+                GROUP BY anime_id
+            )
+            SELECT a.id, a.title, a.start_date, a.total_episodes, a.created_at, a.source_id, a.cover_image_url, ar.score,
+                   r.rank, r.fields, count(*) OVER ()
+            FROM ranked r
+            JOIN Anime a ON a.id = r.anime_id
+            LEFT JOIN AnimeReview ar ON ar.anime_id = a.id
+            ORDER BY r.rank DESC, a.id DESC
+            LIMIT %(limit)s OFFSET %(offset)s
+        """, {
+            "q": q,
+            "pattern": f"%{_escape_like(q)}%",
+            "prefix": f"{_escape_like(q)}%",
+            "limit": limit,
+            "offset": offset,
+        })
+        rows = await cur.fetchall()
+
+        await cur.close()
+
+    return {
+        "total": rows[0][10] if rows else (0 if offset == 0 else None),
+        "results": [
+            {
+                "id": r[0],
+                "title": r[1],
+                "start_date": r[2],
+                "total_episodes": r[3],
+                "created_at": r[4],
+                "source_id": r[5],
+                "cover_image_url": r[6],
+                "my_score": r[7],
+                "rank": round(r[8], 4),
+                "matched": r[9],
+            }
+            for r in rows
+        ],
+    }
+
+
+# GET /anime/{anime_id}（查询单个番剧详情）
+@app.get(
+    "/anime/{anime_id}",
+    response_model=AnimeDetailOut,
+    dependencies=[etag.depends_on(
+        "Anime", "AnimeReview", "Episode", "EpisodeReview", "AnimeProgress", "Collection", "CollectionAnime"
+    )],
+)
+async def get_anime_detail(anime_id: int):
+    # Everything the detail page needs in one round trip; every sub-select
+    # is keyed on anime_id and hits its unique/primary key index.
+    async with get_conn() as conn:
+        cur = conn.cursor()
+
+        await cur.execute("""
+            SELECT a.id, a.title, a.start_date, a.total_episodes, a.created_at, a.source_id, a.cover_image_url,
+                   ar.score, ar.comment, ar.reviewed_at, ar.id IS NOT NULL,
+                   COALESCE((
+                       SELECT json_object_agg(t.episode_type, t.n)
+                       FROM (
+                           SELECT episode_type, count(*) AS n
+                           FROM Episode
+                           WHERE anime_id = a.id
+                           GROUP BY episode_type
+                       ) t
+                   ), '{}'),
+                   (
+                       SELECT count(*)
+                       FROM Episode e
+                       JOIN EpisodeReview er ON er.episode_id = e.id
+                       WHERE e.anime_id = a.id
+                   ),
+                   COALESCE((
+                       SELECT json_agg(json_build_object('id', c.id, 'name', c.name) ORDER BY c.created_at DESC)
+                       FROM CollectionAnime ca
+                       JOIN Collection c ON c.id = ca.collection_id
+                       WHERE ca.anime_id = a.id
+                   ), '[]'),
+                   p.main_episodes, p.watched_episodes, p.avg_episode_score, p.last_episode_score, p.last_reviewed_at
+            FROM Anime a
+            LEFT JOIN AnimeReview ar ON a.id = ar.anime_id
+            LEFT JOIN AnimeProgress p ON a.id = p.anime_id
+            WHERE a.id = %s
+        """, (anime_id,))
+        row = await cur.fetchone()
+
+        await cur.close()
+
+    if not row:
+        raise HTTPException(status_code=404, detail="Anime not found")
+
+    return {
+        "id": row[0],
+        "title": row[1],
+        "start_date": row[2],
+        "total_episodes": row[3],
+        "created_at": row[4],
+        "source_id": row[5],
+        "cover_image_url": row[6],
+        "my_score": row[7],
+        "review": {
+            "score": row[7],
+            "comment": row[8],
+            "reviewed_at": row[9],
+        } if row[10] else None,
+        "episode_counts": row[11],
+        "total_episode_count": sum(row[11].values()),
+        "reviewed_episode_count": row[12],
+        "collections": row[13],
+        "progress": _progress_out(dict(zip(PROGRESS_COLUMNS, row[14:19]))),
+    }
 
 
 # POST /anime/{anime_id}/episodes（添加子集）
 @app.post("/anime/{anime_id}/episodes")
-def create_episode(anime_id: int, episode: EpisodeCreate):
-    conn = get_conn()
-    cur = conn.cursor()
+async def create_episode(anime_id: int, episode: EpisodeCreate):
+    async with get_conn() as conn:
+        cur = conn.cursor()
 
-    cur.execute("""
-        INSERT INTO Episode (
+        await cur.execute("""
+            INSERT INTO Episode (
+                anime_id,
+                episode_code,
+                episode_type,
+                display_order,
+                title,
+                air_date
+            )
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON CONFLICT (anime_id, episode_code)
+            DO NOTHING
+        """, (
             anime_id,
-            episode_code,
-            episode_type,
-            display_order,
-            title,
-            air_date
-        )
-        VALUES (%s, %s, %s, %s, %s, %s)
-        ON CONFLICT (anime_id, episode_code)
-        DO NOTHING
-    """, (
-        anime_id,
-        episode.episode_code,
-        episode.episode_type,
-        episode.display_order,
-        episode.title,
-        episode.air_date
-    ))
+            episode.episode_code,
+            episode.episode_type,
+            episode.display_order,
+            episode.title,
+            episode.air_date
+        ))
+        if cur.rowcount:
+            await refresh_progress(cur, [anime_id])
+
+        await conn.commit()
+        await cur.close()
 
-    conn.commit()
-    cur.close()
-    conn.close()
+    listing_cache.invalidate("episodes", f"anime:{anime_id}")
 
     return {"status": "ok"}
 
 
 # GET /episode（按番剧查剧集）
-@app.get("/anime/{anime_id}/episodes", response_model=list[EpisodeOut])
-def get_episodes(anime_id: int):
-    conn = get_conn()
-    cur = conn.cursor()
-
-    # Sort by Air Date, then fallback to parsing number from code if possible, or string sort
-    cur.execute("""
-        SELECT episode_code, episode_type, display_order, title, air_date
-        FROM Episode
-        WHERE anime_id = %s
-        ORDER BY 
-            CASE 
-                WHEN episode_type = 'main' THEN 0 
-                WHEN episode_type = 'sp' THEN 2 
-                WHEN episode_type = 'ova' THEN 3
-                ELSE 1 
-            END,
-            air_date NULLS LAST, 
-            episode_code
-    """, (anime_id,))
-
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
-
-    return [
-        {
-            "episode_code": r[0],
-            "episode_type": r[1],
-            "display_order": r[2],
-            "title": r[3],
-            "air_date": r[4],
-        }
-        for r in rows
-    ]
+@app.get(
+    "/anime/{anime_id}/episodes",
+    # "review" is only present with include_reviews=true
+    response_model=list[EpisodeWithReviewOut],
+    dependencies=[etag.depends_on("Episode", "EpisodeReview")],
+)
+async def get_episodes(response: Response, anime_id: int, include_reviews: bool = False):
+    async with get_conn() as conn:
+        # Columns in EpisodeOut field order
+        cur = conn.cursor(row_factory=dict_row)
+
+        review_columns = (
+            ", er.score AS review_score, er.comment AS review_comment, er.reviewed_at AS review_reviewed_at,"
+            " er.id IS NOT NULL AS reviewed"
+        ) if include_reviews else ""
+        review_join = "LEFT JOIN EpisodeReview er ON er.episode_id = e.id" if include_reviews else ""
+
+        # Sort by Air Date, then fallback to parsing number from code if possible, or string sort
+        await cur.execute(f"""
+            SELECT e.episode_code, e.episode_type, e.display_order, e.title, e.air_date{review_columns}
+            FROM Episode e
+            {review_join}
+            WHERE e.anime_id = %s
+            ORDER BY 
+                CASE 
+                    WHEN e.episode_type = 'main' THEN 0 
+                    WHEN e.episode_type = 'sp' THEN 2 
+                    WHEN e.episode_type = 'ova' THEN 3
+                    ELSE 1 
+                END,
+                e.air_date NULLS LAST, 
+                e.episode_code
+        """, (anime_id,))
+
+        rows = await cur.fetchall()
+        await cur.close()
+
+    if include_reviews:
+        for row in rows:
+            row["review"] = _pop_review(row)
+
+    return json_response(response, fastjson.dumps(rows))
 
 
 # DELETE /anime/{anime_id}/episodes/{episode_code}（删除子集）
 @app.delete("/anime/{anime_id}/episodes/{episode_code}")
-def delete_episode(anime_id: int, episode_code: str):
-    conn = get_conn()
-    cur = conn.cursor()
-    
-    try:
-        cur.execute("SELECT id FROM Episode WHERE anime_id = %s AND episode_code = %s", (anime_id, episode_code))
-        row = cur.fetchone()
-        
-        if not row:
-            raise HTTPException(status_code=404, detail="Episode not found")
-            
-        episode_id = row[0]
-        cur.execute("DELETE FROM EpisodeReview WHERE episode_id = %s", (episode_id,))
-        cur.execute("DELETE FROM Episode WHERE id = %s", (episode_id,))
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        cur.close()
-        conn.close()
+async def delete_episode(anime_id: int, episode_code: str):
+    async with get_conn() as conn:
+        cur = conn.cursor()
+
+        # The review goes with the episode (ON DELETE CASCADE). Clearing the
+        # fingerprint lets the next sync restore the episode instead of
+        # skipping the title as unchanged.
+        await cur.execute("""
+            WITH deleted AS (
+                DELETE FROM Episode
+                WHERE anime_id = %s AND episode_code = %s
+                RETURNING anime_id
+            )
+            UPDATE Anime SET bangumi_fingerprint = NULL
+            WHERE id IN (SELECT anime_id FROM deleted)
+            RETURNING id
+        """, (anime_id, episode_code))
+        deleted = await cur.fetchone()
+        if deleted:
+            await refresh_progress(cur, [anime_id])
+
+        await cur.close()
+
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Episode not found")
+
+    listing_cache.invalidate("episodes", f"anime:{anime_id}")
         
     return {"status": "ok"}
 
 
 # POST /episode-review（写每话评价）
 @app.post("/anime/{anime_id}/episodes/{episode_code}/review")
-def create_episode_review(
+async def create_episode_review(
     anime_id: int,
     episode_code: str,
     review: EpisodeReviewCreate
 ):
-    conn = get_conn()
-    cur = conn.cursor()
+    async with get_conn() as conn:
+        cur = conn.cursor()
 
-    cur.execute("""
-        SELECT id
-        FROM Episode
-        WHERE anime_id = %s AND episode_code = %s
-    """, (anime_id, episode_code))
+        await cur.execute("""
+            SELECT id
+            FROM Episode
+            WHERE anime_id = %s AND episode_code = %s
+        """, (anime_id, episode_code))
 
-    row = cur.fetchone()
-    if not row:
-        cur.close()
-        conn.close()
-        return {"error": "Episode not found"}
+        row = await cur.fetchone()
+        if not row:
+            await cur.close()
+            return {"error": "Episode not found"}
 
-    episode_id = row[0]
+        episode_id = row[0]
 
-    cur.execute("""
-        INSERT INTO EpisodeReview (episode_id, score, comment)
-        VALUES (%s, %s, %s)
-        ON CONFLICT (episode_id)
-        DO UPDATE SET
-            score = EXCLUDED.score,
-            comment = EXCLUDED.comment,
-            reviewed_at = CURRENT_TIMESTAMP
-    """, (
-        episode_id,
-        review.score,
-        review.comment
-    ))
+        await cur.execute("""
+            INSERT INTO EpisodeReview (episode_id, score, comment)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (episode_id)
+            DO UPDATE SET
+                score = EXCLUDED.score,
+                comment = EXCLUDED.comment,
+                reviewed_at = CURRENT_TIMESTAMP
+        """, (
+            episode_id,
+            review.score,
+            review.comment
+        ))
+        await refresh_progress(cur, [anime_id])
 
-    conn.commit()
-    cur.close()
-    conn.close()
+        await conn.commit()
+        await cur.close()
+
+    listing_cache.invalidate(f"anime:{anime_id}")
 
     return {"status": "ok"}
 
 
+# POST /anime/{anime_id}/episodes/reviews（批量写每话评价）
+@app.post("/anime/{anime_id}/episodes/reviews")
+async def create_episode_reviews(anime_id: int, batch: EpisodeReviewBatch):
+    """
+    Upsert many episode reviews of one anime in a single statement.
+    A null score / comment keeps the stored value. Codes that don't
+    exist for this anime are reported as "unknown".
+    """
+    # Later entries for the same code win
+    reviews = list({r.episode_code: r for r in batch.reviews}.values())
+
+    async with get_conn() as conn:
+        cur = conn.cursor()
+
+        await cur.execute("""
+            WITH input AS (
+                SELECT *
+                FROM unnest(%s::varchar[], %s::int[], %s::text[]) WITH ORDINALITY
+                    AS t(episode_code, score, comment, ord)
+            ),
+            resolved AS (
+                SELECT i.*, e.id AS episode_id
+                FROM input i
+                LEFT JOIN Episode e ON e.anime_id = %s AND e.episode_code = i.episode_code
+            ),
+            upserted AS (
+                INSERT INTO EpisodeReview AS er (episode_id, score, comment)
+                SELECT episode_id, score, comment
+                FROM resolved
+                WHERE episode_id IS NOT NULL
+                ON CONFLICT (episode_id) DO UPDATE SET
+                    score = COALESCE(EXCLUDED.score, er.score),
+                    comment = COALESCE(EXCLUDED.comment, er.comment),
+                    reviewed_at = CURRENT_TIMESTAMP
+                RETURNING er.episode_id
+            )
+            SELECT r.episode_code, u.episode_id IS NOT NULL
+            FROM resolved r
+            LEFT JOIN upserted u ON u.episode_id = r.episode_id
+            ORDER BY r.ord
+        """, (
+            [r.episode_code for r in reviews],
+            [r.score for r in reviews],
+            [r.comment for r in reviews],
+            anime_id,
+        ))
+        rows = await cur.fetchall()
+        saved = sum(1 for r in rows if r[1])
+        if saved:
+            await refresh_progress(cur, [anime_id])
+
+        await cur.close()
+
+    if saved:
+        listing_cache.invalidate(f"anime:{anime_id}")
+
+    results = [{"episode_code": r[0], "status": "ok" if r[1] else "unknown"} for r in rows]
+    return {
+        "status": "ok",
+        "saved": saved,
+        "unknown": len(results) - saved,
+        "results": results,
+    }
+
+
 # GET /anime/{anime_id}/episodes/{episode_code}/review（查子集评价）
-@app.get("/anime/{anime_id}/episodes/{episode_code}/review",response_model=Optional[EpisodeReviewOut])
-def get_episode_review(anime_id: int, episode_code: str):
-    conn = get_conn()
-    cur = conn.cursor()
+@app.get("/anime/{anime_id}/episodes/{episode_code}/review",response_model=Optional[EpisodeReviewOut], dependencies=[etag.depends_on("Episode", "EpisodeReview")])
+async def get_episode_review(anime_id: int, episode_code: str):
+    async with get_conn() as conn:
+        cur = conn.cursor()
 
-    cur.execute("""
-        SELECT er.score, er.comment, er.reviewed_at
-        FROM Episode e
-        LEFT JOIN EpisodeReview er ON e.id = er.episode_id
-        WHERE e.anime_id = %s AND e.episode_code = %s
-    """, (anime_id, episode_code))
+        await cur.execute("""
+            SELECT er.score, er.comment, er.reviewed_at
+            FROM Episode e
+            LEFT JOIN EpisodeReview er ON e.id = er.episode_id
+            WHERE e.anime_id = %s AND e.episode_code = %s
+        """, (anime_id, episode_code))
 
-    row = cur.fetchone()
-    cur.close()
-    conn.close()
+        row = await cur.fetchone()
+        await cur.close()
 
     if not row or row[0] is None:
         return None
@@ -670,49 +1556,49 @@ def get_episode_review(anime_id: int, episode_code: str):
 
 # POST /anime-review（写番剧评价）
 @app.post("/anime/{anime_id}/review")
-def create_anime_review(
+async def create_anime_review(
     anime_id: int,
     review: AnimeReviewCreate
 ):
-    conn = get_conn()
-    cur = conn.cursor()
+    async with get_conn() as conn:
+        cur = conn.cursor()
 
-    cur.execute("""
-        INSERT INTO AnimeReview (anime_id, score, comment)
-        VALUES (%s, %s, %s)
-        ON CONFLICT (anime_id)
-        DO UPDATE SET
-            score = EXCLUDED.score,
-            comment = EXCLUDED.comment,
-            reviewed_at = CURRENT_TIMESTAMP
-    """, (
-        anime_id,
-        review.score,
-        review.comment
-    ))
+        await cur.execute("""
+            INSERT INTO AnimeReview (anime_id, score, comment)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (anime_id)
+            DO UPDATE SET
+                score = EXCLUDED.score,
+                comment = EXCLUDED.comment,
+                reviewed_at = CURRENT_TIMESTAMP
+        """, (
+            anime_id,
+            review.score,
+            review.comment
+        ))
+
+        await conn.commit()
+        await cur.close()
 
-    conn.commit()
-    cur.close()
-    conn.close()
+    listing_cache.invalidate(f"anime:{anime_id}", "score")
 
     return {"status": "ok"}
 
 
 # GET /anime/{anime_id}/review（按番剧评价）
-@app.get("/anime/{anime_id}/review",response_model=Optional[AnimeReviewOut])
-def get_anime_review(anime_id: int):
-    conn = get_conn()
-    cur = conn.cursor()
+@app.get("/anime/{anime_id}/review",response_model=Optional[AnimeReviewOut], dependencies=[etag.depends_on("AnimeReview")])
+async def get_anime_review(anime_id: int):
+    async with get_conn() as conn:
+        cur = conn.cursor()
 
-    cur.execute("""
-        SELECT score, comment, reviewed_at
-        FROM AnimeReview
-        WHERE anime_id = %s
-    """, (anime_id,))
+        await cur.execute("""
+            SELECT score, comment, reviewed_at
+            FROM AnimeReview
+            WHERE anime_id = %s
+        """, (anime_id,))
 
-    row = cur.fetchone()
-    cur.close()
-    conn.close()
+        row = await cur.fetchone()
+        await cur.close()
 
     if not row:
         return None
@@ -726,23 +1612,24 @@ def get_anime_review(anime_id: int):
 
 # POST /collections（创建收藏夹）
 @app.post("/collections", response_model=CollectionOut)
-def create_collection(collection: CollectionCreate):
-    conn = get_conn()
-    cur = conn.cursor()
-
-    cur.execute("""
-        INSERT INTO Collection (name, description)
-        VALUES (%s, %s)
-        RETURNING id, name, description, created_at
-    """, (
-        collection.name,
-        collection.description
-    ))
+async def create_collection(collection: CollectionCreate):
+    async with get_conn() as conn:
+        cur = conn.cursor()
+
+        await cur.execute("""
+            INSERT INTO Collection (name, description)
+            VALUES (%s, %s)
+            RETURNING id, name, description, created_at
+        """, (
+            collection.name,
+            collection.description
+        ))
+
+        row = await cur.fetchone()
+        await conn.commit()
+        await cur.close()
 
-    row = cur.fetchone()
-    conn.commit()
-    cur.close()
-    conn.close()
+    listing_cache.invalidate("collections")
 
     return {
         "id": row[0],
@@ -754,33 +1641,34 @@ def create_collection(collection: CollectionCreate):
 
 # PUT /collections/{collection_id}（更新收藏夹）
 @app.put("/collections/{collection_id}", response_model=CollectionOut)
-def update_collection(collection_id: int, collection: CollectionCreate):
-    conn = get_conn()
-    cur = conn.cursor()
+async def update_collection(collection_id: int, collection: CollectionCreate):
+    async with get_conn() as conn:
+        cur = conn.cursor()
 
-    try:
-        cur.execute("""
-            UPDATE Collection
-            SET name = %s, description = %s
-            WHERE id = %s
-            RETURNING id, name, description, created_at
-        """, (
-            collection.name,
-            collection.description,
-            collection_id
-        ))
-        
-        row = cur.fetchone()
-        if not row:
-            raise HTTPException(status_code=404, detail="Collection not found")
-            
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        cur.close()
-        conn.close()
+        try:
+            await cur.execute("""
+                UPDATE Collection
+                SET name = %s, description = %s
+                WHERE id = %s
+                RETURNING id, name, description, created_at
+            """, (
+                collection.name,
+                collection.description,
+                collection_id
+            ))
+
+            row = await cur.fetchone()
+            if not row:
+                raise HTTPException(status_code=404, detail="Collection not found")
+
+            await conn.commit()
+        except Exception as e:
+            await conn.rollback()
+            raise e
+        finally:
+            await cur.close()
+
+    listing_cache.invalidate("collections")
 
     return {
         "id": row[0],
@@ -792,193 +1680,250 @@ def update_collection(collection_id: int, collection: CollectionCreate):
 
 # DELETE /collections/{collection_id}（删除收藏夹）
 @app.delete("/collections/{collection_id}")
-def delete_collection(collection_id: int):
-    conn = get_conn()
-    cur = conn.cursor()
-    
-    try:
-        # Delete relationships first
-        cur.execute("DELETE FROM CollectionAnime WHERE collection_id = %s", (collection_id,))
-        
-        # Delete collection
-        cur.execute("DELETE FROM Collection WHERE id = %s", (collection_id,))
-        
-        if cur.rowcount == 0:
-            raise HTTPException(status_code=404, detail="Collection not found")
-            
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        cur.close()
-        conn.close()
+async def delete_collection(collection_id: int):
+    async with get_conn() as conn:
+        cur = conn.cursor()
+
+        try:
+            # Delete relationships first
+            await cur.execute("DELETE FROM CollectionAnime WHERE collection_id = %s", (collection_id,))
+
+            # Delete collection
+            await cur.execute("DELETE FROM Collection WHERE id = %s", (collection_id,))
+
+            if cur.rowcount == 0:
+                raise HTTPException(status_code=404, detail="Collection not found")
+
+            await conn.commit()
+        except Exception as e:
+            await conn.rollback()
+            raise e
+        finally:
+            await cur.close()
+
+    listing_cache.invalidate("collections", f"collection:{collection_id}")
         
     return {"status": "ok"}
 
 
+async def list_collections():
+    async with get_conn() as conn:
+        # Columns in CollectionOut field order
+        cur = conn.cursor(row_factory=dict_row)
+
+        await cur.execute("""
+            SELECT id, name, description, created_at
+            FROM Collection
+            ORDER BY created_at DESC
+        """)
+
+        rows = await cur.fetchall()
+        await cur.close()
+
+    return rows
+
+
 # GET /collections（获取收藏夹列表）
-@app.get("/collections", response_model=list[CollectionOut])
-def get_collections():
-    conn = get_conn()
-    cur = conn.cursor()
+@app.get("/collections", response_model=list[CollectionOut], dependencies=[etag.depends_on("Collection")])
+async def get_collections(request: Request, response: Response):
+    async def build():
+        return fastjson.dumps(await list_collections()), {}, ["collections"]
 
-    cur.execute("""
-        SELECT id, name, description, created_at
-        FROM Collection
-        ORDER BY created_at DESC
-    """)
+    return await cached_listing(request, response, build)
 
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
 
-    return [
-        {
-            "id": r[0],
-            "name": r[1],
-            "description": r[2],
-            "created_at": r[3],
-        }
-        for r in rows
-    ]
+# GET /collections/{collection_id}（查询单个收藏夹）
+@app.get("/collections/{collection_id}", response_model=CollectionDetailOut, dependencies=[etag.depends_on("Collection", "CollectionAnime")])
+async def get_collection(collection_id: int):
+    async with get_conn() as conn:
+        cur = conn.cursor()
+
+        await cur.execute("""
+            SELECT c.id, c.name, c.description, c.created_at,
+                   (SELECT count(*) FROM CollectionAnime ca WHERE ca.collection_id = c.id)
+            FROM Collection c
+            WHERE c.id = %s
+        """, (collection_id,))
+        row = await cur.fetchone()
+
+        await cur.close()
+
+    if not row:
+        raise HTTPException(status_code=404, detail="Collection not found")
+
+    return {
+        "id": row[0],
+        "name": row[1],
+        "description": row[2],
+        "created_at": row[3],
+        "anime_count": row[4],
+    }
 
 
 # POST /collections/{collection_id}/anime（收藏夹添加动漫）
 @app.post("/collections/{collection_id}/anime")
-def add_anime_to_collection(
+async def add_anime_to_collection(
     collection_id: int,
     data: CollectionAnimeCreate
 ):
-    conn = get_conn()
-    cur = conn.cursor()
+    async with get_conn() as conn:
+        cur = conn.cursor()
 
-    cur.execute("""
-        INSERT INTO CollectionAnime (collection_id, anime_id)
-        VALUES (%s, %s)
-        ON CONFLICT DO NOTHING
-    """, (
-        collection_id,
-        data.anime_id
-    ))
+        await cur.execute("""
+            INSERT INTO CollectionAnime (collection_id, anime_id)
+            VALUES (%s, %s)
+            ON CONFLICT DO NOTHING
+        """, (
+            collection_id,
+            data.anime_id
+        ))
+
+        await conn.commit()
+        await cur.close()
 
-    conn.commit()
-    cur.close()
-    conn.close()
+    listing_cache.invalidate(f"collection:{collection_id}")
 
     return {"status": "ok"}
 
 
+async def _check_collection_exists(cur, collection_id: int):
+    await cur.execute("SELECT 1 FROM Collection WHERE id = %s", (collection_id,))
+    if not await cur.fetchone():
+        raise HTTPException(status_code=404, detail="Collection not found")
+
+
+# POST /collections/{collection_id}/anime/add（收藏夹批量添加动漫）
+@app.post("/collections/{collection_id}/anime/add")
+async def add_anime_to_collection_bulk(collection_id: int, data: CollectionAnimeBatch):
+    async with get_conn() as conn:
+        cur = conn.cursor()
+
+        await _check_collection_exists(cur, collection_id)
+        # Unknown anime ids are skipped rather than failing the batch
+        await cur.execute("""
+            INSERT INTO CollectionAnime (collection_id, anime_id)
+            SELECT %s, a.id
+            FROM Anime a
+            WHERE a.id = ANY(%s)
+            ON CONFLICT DO NOTHING
+            RETURNING anime_id
+        """, (collection_id, data.anime_ids))
+        added = sorted(row[0] for row in await cur.fetchall())
+
+        await cur.close()
+
+    if added:
+        listing_cache.invalidate(f"collection:{collection_id}")
+
+    return {"status": "ok", "changed": len(added), "anime_ids": added}
+
+
+# POST /collections/{collection_id}/anime/remove（收藏夹批量移除动漫）
+@app.post("/collections/{collection_id}/anime/remove")
+async def remove_anime_from_collection_bulk(collection_id: int, data: CollectionAnimeBatch):
+    async with get_conn() as conn:
+        cur = conn.cursor()
+
+        await _check_collection_exists(cur, collection_id)
+        await cur.execute("""
+            DELETE FROM CollectionAnime
+            WHERE collection_id = %s AND anime_id = ANY(%s)
+            RETURNING anime_id
+        """, (collection_id, data.anime_ids))
+        removed = sorted(row[0] for row in await cur.fetchall())
+
+        await cur.close()
+
+    if removed:
+        listing_cache.invalidate(f"collection:{collection_id}")
+
+    return {"status": "ok", "changed": len(removed), "anime_ids": removed}
+
+
 # GET /collections/{collection_id}/anime（收藏夹的动漫列表）
-@app.get("/collections/{collection_id}/anime", response_model=list[AnimeOut])
-def get_collection_anime(collection_id: int):
-    conn = get_conn()
-    cur = conn.cursor()
+@app.get(
+    "/collections/{collection_id}/anime",
+    response_model=list[AnimeOut],
+    dependencies=[etag.depends_on("Anime", "AnimeReview", "Episode", "AnimeProgress", "CollectionAnime")],
+)
+async def get_collection_anime(
+    collection_id: int,
+    request: Request,
+    response: Response,
+    params: Annotated[AnimeListQuery, Query()]
+):
+    return await cached_listing(request, response, lambda: _anime_listing(params, collection_id))
 
-    cur.execute("""
-        SELECT a.id, a.title, a.start_date, a.total_episodes, a.created_at, a.source_id, a.cover_image_url, ar.score
-        FROM Anime a
-        JOIN CollectionAnime ca ON a.id = ca.anime_id
-        LEFT JOIN AnimeReview ar ON a.id = ar.anime_id
-        WHERE ca.collection_id = %s
-        ORDER BY a.created_at DESC
-    """, (collection_id,))
-
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
-
-    return [
-        {
-            "id": r[0],
-            "title": r[1],
-            "start_date": r[2],
-            "total_episodes": r[3],
-            "created_at": r[4],
-            "source_id": r[5],
-            "cover_image_url": r[6],
-            "my_score": r[7]
-        }
-        for r in rows
-    ]
+
+# Overall time budget (seconds) for the detail fetches of one search
+SEARCH_DETAIL_DEADLINE = float(os.getenv("BANGUMI_SEARCH_DEADLINE", "5"))
 
 
 # GET /bangumi/search（搜索 Bangumi）
 @app.get("/bangumi/search", response_model=dict)
-def search_bangumi(query: str):
+async def search_bangumi(query: str):
     """搜索 Bangumi 番剧"""
     try:
         # Bangumi 搜索 API
-        search_response = requests.get(
-            f"https://api.bgm.tv/search/subject/{query}",
-            params={"type": 2, "responseGroup": "large"},  # type=2 表示动画
-            headers={"User-Agent": "MyAnimeTrack/1.0 (https://github.com/yourusername/MyAnimeTrack)"},
-            timeout=10
-        )
-        search_response.raise_for_status()
-        search_data = search_response.json()
+        search_data = await bangumi.search_subjects(query)
         
+        items = [item for item in search_data.get("list", [])[:10] if item.get("id")]  # 最多返回10个结果
+
+        # 并发获取详细信息，整体共用一个截止时间
+        details = await bangumi.get_subjects([item["id"] for item in items], deadline=SEARCH_DETAIL_DEADLINE)
+
         # 格式化搜索结果
         results = []
-        for item in search_data.get("list", [])[:10]:  # 最多返回10个结果
-            # 获取详细信息
-            subject_id = item.get("id")
-            if subject_id:
-                try:
-                    detail_response = requests.get(
-                        f"https://api.bgm.tv/v0/subjects/{subject_id}",
-                        headers={"User-Agent": "MyAnimeTrack/1.0"},
-                        timeout=10
-                    )
-                    detail_response.raise_for_status()
-                    detail_data = detail_response.json()
-                    
-                    # 提取开播日期
-                    start_date = detail_data.get("date")
-                    if start_date and len(start_date) >= 10:
-                        start_date = start_date[:10]  # 只取日期部分
-                    else:
-                        start_date = None
-                    
-                    # 提取总集数
-                    total_episodes = detail_data.get("eps") or detail_data.get("total_episodes")
-                    
-                    # 提取封面图片
-                    images = detail_data.get("images", {})
-                    cover_image = images.get("large") or images.get("common") or images.get("medium")
-                    
-                    results.append({
-                        "id": subject_id,
-                        "title": detail_data.get("name_cn") or detail_data.get("name"),
-                        "name_jp": detail_data.get("name"),
-                        "name_cn": detail_data.get("name_cn"),
-                        "start_date": start_date,
-                        "total_episodes": total_episodes,
-                        "cover_image": cover_image,
-                        "summary": detail_data.get("summary", ""),
-                        "source_id": f"BGM-{subject_id}"
-                    })
-                except Exception as e:
-                    # 如果获取详情失败，使用搜索结果中的基本信息
-                    images = item.get("images", {}) if item.get("images") else {}
-                    cover_image = images.get("large") or images.get("common") if images else None
-                    results.append({
-                        "id": subject_id,
-                        "title": item.get("name_cn") or item.get("name"),
-                        "name_jp": item.get("name"),
-                        "name_cn": item.get("name_cn"),
-                        "start_date": None,
-                        "total_episodes": item.get("eps"),
-                        "cover_image": cover_image,
-                        "summary": item.get("summary", ""),
-                        "source_id": f"BGM-{subject_id}"
-                    })
-                    continue
-        
+        for item in items:
+            subject_id = item["id"]
+            detail_data = details.get(subject_id)
+            if detail_data:
+                # 提取开播日期
+                start_date = detail_data.get("date")
+                if start_date and len(start_date) >= 10:
+                    start_date = start_date[:10]  # 只取日期部分
+                else:
+                    start_date = None
+
+                # 提取总集数
+                total_episodes = detail_data.get("eps") or detail_data.get("total_episodes")
+
+                # 提取封面图片
+                images = detail_data.get("images", {})
+                cover_image = images.get("large") or images.get("common") or images.get("medium")
+
+                results.append({
+                    "id": subject_id,
+                    "title": detail_data.get("name_cn") or detail_data.get("name"),
+                    "name_jp": detail_data.get("name"),
+                    "name_cn": detail_data.get("name_cn"),
+                    "start_date": start_date,
+                    "total_episodes": total_episodes,
+                    "cover_image": cover_image,
+                    "summary": detail_data.get("summary", ""),
+                    "source_id": f"BGM-{subject_id}"
+                })
+            else:
+                # 如果获取详情失败或超时，使用搜索结果中的基本信息
+                images = item.get("images", {}) if item.get("images") else {}
+                cover_image = images.get("large") or images.get("common") if images else None
+                air_date = item.get("air_date")
+                results.append({
+                    "id": subject_id,
+                    "title": item.get("name_cn") or item.get("name"),
+                    "name_jp": item.get("name"),
+                    "name_cn": item.get("name_cn"),
+                    "start_date": air_date if air_date and not air_date.startswith("0000") else None,
+                    "total_episodes": item.get("eps"),
+                    "cover_image": cover_image,
+                    "summary": item.get("summary", ""),
+                    "source_id": f"BGM-{subject_id}"
+                })
+
         return {"results": results}
-    except requests.Timeout:
+    except httpx.TimeoutException:
         return {"error": "请求超时，请稍后重试", "results": []}
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         return {"error": f"Bangumi API 错误: {str(e)}", "results": []}
     except Exception as e:
         return {"error": f"搜索失败: {str(e)}", "results": []}
@@ -986,22 +1931,412 @@ def search_bangumi(query: str):
 
 # DELETE /collections/{collection_id}/anime/{anime_id}（从收藏夹移除动漫）
 @app.delete("/collections/{collection_id}/anime/{anime_id}")
-def remove_anime_from_collection(collection_id: int, anime_id: int):
-    conn = get_conn()
-    cur = conn.cursor()
-    
-    try:
-        cur.execute("""
-            DELETE FROM CollectionAnime 
-            WHERE collection_id = %s AND anime_id = %s
-        """, (collection_id, anime_id))
-        
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        cur.close()
-        conn.close()
+async def remove_anime_from_collection(collection_id: int, anime_id: int):
+    async with get_conn() as conn:
+        cur = conn.cursor()
+
+        try:
+            await cur.execute("""
+                DELETE FROM CollectionAnime 
+                WHERE collection_id = %s AND anime_id = %s
+            """, (collection_id, anime_id))
+
+            await conn.commit()
+        except Exception as e:
+            await conn.rollback()
+            raise e
+        finally:
+            await cur.close()
+
+    listing_cache.invalidate(f"collection:{collection_id}")
         
     return {"status": "ok"}
+
+
+# NDJSON backup format of GET /export and POST /import: one JSON object per
+# line, told apart by "type". Ids only link lines within one file; the
+# import maps them onto the ids of the target database.
+EXPORT_FORMAT = "myanimetrack"
+EXPORT_VERSION = 1
+# Rows per server-side cursor fetch / per COPY batch, so neither direction
+# ever holds more than this many rows in memory
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "2000"))
+
+EXPORT_QUERIES = [
+    ("anime", """
+        SELECT a.id, a.title, a.start_date, a.total_episodes, a.created_at, a.source_id, a.cover_image_url,
+               ar.score AS review_score, ar.comment AS review_comment, ar.reviewed_at AS review_reviewed_at,
+               ar.id IS NOT NULL AS reviewed
+        FROM Anime a
+        LEFT JOIN AnimeReview ar ON ar.anime_id = a.id
+        ORDER BY a.id
+    """),
+    ("episode", """
+        SELECT e.anime_id, e.episode_code, e.episode_type, e.display_order, e.title, e.air_date,
+               er.score AS review_score, er.comment AS review_comment, er.reviewed_at AS review_reviewed_at,
+               er.id IS NOT NULL AS reviewed
+        FROM Episode e
+        LEFT JOIN EpisodeReview er ON er.episode_id = e.id
+        ORDER BY e.anime_id, e.episode_code
+    """),
+    ("collection", """
+        SELECT id, name, description, created_at
+        FROM Collection
+        ORDER BY id
+    """),
+    ("collection_anime", """
+        SELECT collection_id, anime_id
+        FROM CollectionAnime
+        ORDER BY collection_id, anime_id
+    """),
+]
+
+
+async def export_library():
+    """Yield the whole library as NDJSON chunks, one chunk per fetched batch."""
+    yield fastjson.dumps({
+        "type": "meta",
+        "format": EXPORT_FORMAT,
+        "version": EXPORT_VERSION,
+        "exported_at": datetime.now(),
+    }) + b"\n"
+
+    async with get_conn() as conn:
+        # Every cursor reads the same snapshot, so memberships always point
+        # at exported anime even while the library is being written to
+        await conn.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+
+        for kind, query in EXPORT_QUERIES:
+            # Named cursor: rows stay on the server until fetched
+            cur = conn.cursor(name=f"export_{kind}", row_factory=dict_row)
+            await cur.execute(query)
+            while rows := await cur.fetchmany(EXPORT_BATCH_SIZE):
+                lines = []
+                for row in rows:
+                    if "reviewed" in row:
+                        row["review"] = _pop_review(row)
+                    lines.append(fastjson.dumps({"type": kind, **row}))
+                yield b"\n".join(lines) + b"\n"
+            await cur.close()
+
+
+# GET /export（导出整个番剧库，NDJSON）
+@app.get("/export")
+async def export_ndjson():
+    filename = f"myanimetrack-{date.today().isoformat()}.ndjson"
+    return StreamingResponse(
+        export_library(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+def _flatten_review(item: dict):
+    review = item.get("review")
+    if review is None:
+        return None, None, None, False
+    return review.get("score"), review.get("comment"), review.get("reviewed_at"), True
+
+
+# Staging table and columns per line type, and how a line becomes a row
+IMPORT_TABLES = {
+    "anime": (
+        "import_anime",
+        ("id", "title", "start_date", "total_episodes", "created_at", "source_id", "cover_image_url",
+         "review_score", "review_comment", "review_reviewed_at", "reviewed"),
+        lambda item: (
+            item["id"], item["title"], item.get("start_date"), item.get("total_episodes"), item.get("created_at"),
+            item.get("source_id"), item.get("cover_image_url"), *_flatten_review(item),
+        ),
+    ),
+    "episode": (
+        "import_episode",
+        ("anime_id", "episode_code", "episode_type", "display_order", "title", "air_date",
+         "review_score", "review_comment", "review_reviewed_at", "reviewed"),
+        lambda item: (
+            item["anime_id"], item["episode_code"], item["episode_type"], item.get("display_order"),
+            item.get("title"), item.get("air_date"), *_flatten_review(item),
+        ),
+    ),
+    "collection": (
+        "import_collection",
+        ("id", "name", "description", "created_at"),
+        lambda item: (item["id"], item["name"], item.get("description"), item.get("created_at")),
+    ),
+    "collection_anime": (
+        "import_collection_anime",
+        ("collection_id", "anime_id"),
+        lambda item: (item["collection_id"], item["anime_id"]),
+    ),
+}
+
+
+async def _ndjson_lines(request: Request):
+    """(line number, decoded object) for every non-blank line of the request body."""
+    buffer = b""
+    number = 0
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            number += 1
+            if line.strip():
+                yield number, _decode_ndjson_line(number, line)
+    if buffer.strip():
+        yield number + 1, _decode_ndjson_line(number + 1, buffer)
+
+
+def _decode_ndjson_line(number: int, line: bytes):
+    try:
+        item = fastjson.loads(line)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Line {number}: invalid JSON ({e})")
+    if not isinstance(item, dict):
+        raise HTTPException(status_code=400, detail=f"Line {number}: expected a JSON object")
+    return item
+
+
+async def _stage_import(cur, request: Request):
+    """
+    COPY the request body into temporary staging tables, EXPORT_BATCH_SIZE
+    rows at a time. Returns the number of lines per type.
+    """
+    await cur.execute("""
+        CREATE TEMP TABLE import_anime (
+            id INT NOT NULL, title VARCHAR(255), start_date DATE, total_episodes INT, created_at TIMESTAMP,
+            source_id VARCHAR(100), cover_image_url TEXT,
+            review_score INT, review_comment TEXT, review_reviewed_at TIMESTAMP, reviewed BOOLEAN,
+            new_id INT
+        ) ON COMMIT DROP;
+        CREATE TEMP TABLE import_episode (
+            anime_id INT NOT NULL, episode_code VARCHAR(255), episode_type VARCHAR(255), display_order INT,
+            title VARCHAR(255), air_date DATE,
+            review_score INT, review_comment TEXT, review_reviewed_at TIMESTAMP, reviewed BOOLEAN
+        ) ON COMMIT DROP;
+        CREATE TEMP TABLE import_collection (
+            id INT NOT NULL, name VARCHAR(255), description TEXT, created_at TIMESTAMP,
+            new_id INT
+        ) ON COMMIT DROP;
+        CREATE TEMP TABLE import_collection_anime (
+            collection_id INT NOT NULL, anime_id INT NOT NULL
+        ) ON COMMIT DROP;
+    """)
+
+    batches = {kind: [] for kind in IMPORT_TABLES}
+    counts = {kind: 0 for kind in IMPORT_TABLES}
+
+    async def flush(kind):
+        table, columns, _ = IMPORT_TABLES[kind]
+        async with cur.copy(f"COPY {table} ({', '.join(columns)}) FROM STDIN") as copy:
+            for row in batches[kind]:
+                await copy.write_row(row)
+        batches[kind].clear()
+
+    async for number, item in _ndjson_lines(request):
+        if not isinstance(item, dict):
+            raise HTTPException(status_code=400, detail=f"Line {number}: expected a JSON object")
+        kind = item.get("type")
+        if kind == "meta":
+            if item.get("format") != EXPORT_FORMAT or item.get("version") != EXPORT_VERSION:
+                raise HTTPException(status_code=400, detail=f"Line {number}: unsupported export format / version")
+            continue
+        if kind not in IMPORT_TABLES:
+            raise HTTPException(status_code=400, detail=f"Line {number}: unknown type {kind!r}")
+        _, columns, to_row = IMPORT_TABLES[kind]
+        try:
+            row = to_row(item)
+        except KeyError as e:
+            raise HTTPException(status_code=400, detail=f"Line {number}: missing field {e}")
+        except AttributeError:
+            raise HTTPException(status_code=400, detail=f"Line {number}: review must be an object")
+        # COPY can only adapt scalars, objects / arrays are a client error
+        for column, value in zip(columns, row):
+            if isinstance(value, (dict, list)):
+                raise HTTPException(status_code=400, detail=f"Line {number}: {column} must be a scalar value")
+        batches[kind].append(row)
+        counts[kind] += 1
+        if len(batches[kind]) >= EXPORT_BATCH_SIZE:
+            await flush(kind)
+
+    for kind in IMPORT_TABLES:
+        if batches[kind]:
+            await flush(kind)
+    return counts
+
+
+async def _merge_import(cur):
+    """
+    Merge the staging tables into the library; rows already in the
+    library win. Anime are matched by source_id (by title and start date
+    without one), collections by name against the collections already in
+    the library; everything else is added.
+    """
+    result = {}
+
+    # Map every imported anime onto an existing row or a freshly allocated id
+    await cur.execute("""
+        UPDATE import_anime i SET new_id = a.id
+        FROM Anime a
+        WHERE i.source_id IS NOT NULL AND a.source_id = i.source_id
+    """)
+    await cur.execute("""
+        UPDATE import_anime i SET new_id = a.id
+        FROM Anime a
+        WHERE i.new_id IS NULL AND i.source_id IS NULL AND a.source_id IS NULL
+          AND a.title = i.title AND a.start_date IS NOT DISTINCT FROM i.start_date
+    """)
+    await cur.execute("""
+        WITH fresh AS (
+            SELECT key, nextval(pg_get_serial_sequence('anime', 'id')) AS new_id
+            FROM (SELECT DISTINCT COALESCE(source_id, '#' || id) AS key FROM import_anime WHERE new_id IS NULL) k
+        )
+        UPDATE import_anime i SET new_id = f.new_id
+        FROM fresh f
+        WHERE i.new_id IS NULL AND COALESCE(i.source_id, '#' || i.id) = f.key
+    """)
+    await cur.execute("""
+        INSERT INTO Anime (id, title, start_date, total_episodes, created_at, source_id, cover_image_url)
+        SELECT DISTINCT ON (new_id)
+               new_id, title, start_date, total_episodes, COALESCE(created_at, CURRENT_TIMESTAMP), source_id, cover_image_url
+        FROM import_anime i
+        WHERE NOT EXISTS (SELECT 1 FROM Anime a WHERE a.id = i.new_id)
+        ORDER BY new_id
+    """)
+    result["anime"] = cur.rowcount
+    await cur.execute("""
+        INSERT INTO AnimeReview (anime_id, score, comment, reviewed_at)
+        SELECT DISTINCT ON (new_id)
+               new_id, review_score, review_comment, COALESCE(review_reviewed_at, CURRENT_TIMESTAMP)
+        FROM import_anime
+        WHERE reviewed
+        ORDER BY new_id
+        ON CONFLICT (anime_id) DO NOTHING
+    """)
+    result["anime_reviews"] = cur.rowcount
+
+    await cur.execute("""
+        INSERT INTO Episode (anime_id, episode_code, episode_type, display_order, title, air_date)
+        SELECT DISTINCT ON (m.new_id, e.episode_code)
+               m.new_id, e.episode_code, e.episode_type, COALESCE(e.display_order, 0), e.title, e.air_date
+        FROM import_episode e
+        JOIN (SELECT DISTINCT ON (id) id, new_id FROM import_anime) m ON m.id = e.anime_id
+        ORDER BY m.new_id, e.episode_code
+        ON CONFLICT (anime_id, episode_code) DO NOTHING
+    """)
+    result["episodes"] = cur.rowcount
+    await cur.execute("""
+        INSERT INTO EpisodeReview (episode_id, score, comment, reviewed_at)
+        SELECT DISTINCT ON (ep.id)
+               ep.id, e.review_score, e.review_comment, COALESCE(e.review_reviewed_at, CURRENT_TIMESTAMP)
+        FROM import_episode e
+        JOIN (SELECT DISTINCT ON (id) id, new_id FROM import_anime) m ON m.id = e.anime_id
+        JOIN Episode ep ON ep.anime_id = m.new_id AND ep.episode_code = e.episode_code
+        WHERE e.reviewed
+        ORDER BY ep.id
+        ON CONFLICT (episode_id) DO NOTHING
+    """)
+    result["episode_reviews"] = cur.rowcount
+
+    await cur.execute("""
+        UPDATE import_collection i SET new_id = c.id
+        FROM Collection c
+        WHERE c.name = i.name
+    """)
+    await cur.execute("""
+        WITH fresh AS (
+            SELECT id, nextval(pg_get_serial_sequence('collection', 'id')) AS new_id
+            FROM (SELECT DISTINCT id FROM import_collection WHERE new_id IS NULL) n
+        )
+        UPDATE import_collection i SET new_id = f.new_id
+        FROM fresh f
+        WHERE i.new_id IS NULL AND i.id = f.id
+    """)
+    await cur.execute("""
+        INSERT INTO Collection (id, name, description, created_at)
+        SELECT DISTINCT ON (new_id) new_id, name, description, COALESCE(created_at, CURRENT_TIMESTAMP)
+        FROM import_collection i
+        WHERE NOT EXISTS (SELECT 1 FROM Collection c WHERE c.id = i.new_id)
+        ORDER BY new_id
+    """)
+    result["collections"] = cur.rowcount
+    await cur.execute("""
+        INSERT INTO CollectionAnime (collection_id, anime_id)
+        SELECT DISTINCT c.new_id, a.new_id
+        FROM import_collection_anime ca
+        JOIN import_collection c ON c.id = ca.collection_id
+        JOIN import_anime a ON a.id = ca.anime_id
+        ON CONFLICT DO NOTHING
+    """)
+    result["collection_anime"] = cur.rowcount
+
+    return result
+
+
+# POST /import（从 NDJSON 备份导入）
+@app.post("/import")
+async def import_ndjson(request: Request):
+    """
+    Load a GET /export file (the raw NDJSON request body) into the library.
+    The body is streamed into staging tables with COPY and merged with a
+    fixed number of set-based statements, all in one transaction: a bad
+    line rejects the whole file.
+    """
+    async with get_conn() as conn:
+        cur = conn.cursor()
+        try:
+            lines = await _stage_import(cur, request)
+            added = await _merge_import(cur)
+
+            await cur.execute("SELECT DISTINCT new_id FROM import_anime")
+            await refresh_progress(cur, [row[0] for row in await cur.fetchall()])
+        except (psycopg.errors.DataError, psycopg.errors.IntegrityError) as e:
+            await conn.rollback()
+            raise HTTPException(status_code=400, detail=f"Invalid import data: {e}")
+        finally:
+            await cur.close()
+
+    listing_cache.clear()
+
+    return {"status": "ok", "lines": lines, "added": added}
+
+
+# GET /stats/db（数据库连接池状态）
+@app.get("/stats/db")
+async def get_db_stats():
+    return db.pool_stats()
+
+
+# GET /stats/listings（列表缓存状态）
+@app.get("/stats/listings")
+async def get_listing_stats():
+    return listing_cache.stats()
+
+
+# GET /stats/bangumi（Bangumi 缓存与限流状态）
+@app.get("/stats/bangumi")
+async def get_bangumi_stats():
+    return bangumi.stats()
+
+
+# GET /jobs（后台任务列表）
+@app.get("/jobs", response_model=list[JobOut])
+async def get_jobs():
+    return [job.to_dict() for job in jobs.list_jobs()]
+
+
+# GET /jobs/{job_id}（后台任务进度）
+@app.get("/jobs/{job_id}", response_model=JobOut)
+async def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
+# POST /jobs/{job_id}/cancel（取消后台任务）
+@app.post("/jobs/{job_id}/cancel", response_model=JobOut)
+async def cancel_job(job_id: str):
+    job = jobs.cancel(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
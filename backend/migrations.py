@@ -0,0 +1,92 @@
+import asyncio
+import os
+import re
+
+from db import get_conn
+
+
+# Numbered SQL files, e.g. migrations/0002_indexes_and_cascades.sql. Each
+# runs once, in order, in its own transaction; applied versions are
+# recorded in schema_migrations.
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+# Set DB_AUTO_MIGRATE=0 to skip migrating at startup (run `python migrations.py`)
+AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "1") != "0"
+
+# Arbitrary key for pg_advisory_lock, so concurrently starting workers
+# don't apply the same migration twice
+_LOCK_KEY = 0x4D415452  # "MATR"
+
+_FILENAME = re.compile(r"^(\d+)_(\w+)\.sql$")
+
+
+def available():
+    """[(version, name, path), ...] sorted by version."""
+    found = []
+    for filename in os.listdir(MIGRATIONS_DIR):
+        match = _FILENAME.match(filename)
+        if match:
+            found.append((int(match.group(1)), match.group(2), os.path.join(MIGRATIONS_DIR, filename)))
+    found.sort()
+    versions = [version for version, _, _ in found]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError(f"Duplicate migration version in {MIGRATIONS_DIR}")
+    return found
+
+
+async def migrate():
+    """Apply pending migrations. Returns the versions applied."""
+    applied_now = []
+
+    async with get_conn() as conn:
+        await conn.set_autocommit(True)
+        cur = conn.cursor()
+        try:
+            await cur.execute("SELECT pg_advisory_lock(%s)", (_LOCK_KEY,))
+            await cur.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INT PRIMARY KEY,
+                    name VARCHAR(255) NOT NULL,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            await cur.execute("SELECT version FROM schema_migrations")
+            done = {row[0] for row in await cur.fetchall()}
+
+            for version, name, path in available():
+                if version in done:
+                    continue
+                with open(path, encoding="utf-8") as f:
+                    sql = f.read()
+                try:
+                    async with conn.transaction():
+                        await cur.execute(sql)
+                        await cur.execute(
+                            "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                            (version, name)
+                        )
+                except Exception as e:
+                    print(f"Migration {version:04d}_{name} failed: {e}")
+                    raise
+                print(f"Applied migration {version:04d}_{name}")
+                applied_now.append(version)
+        finally:
+            await cur.execute("SELECT pg_advisory_unlock(%s)", (_LOCK_KEY,))
+            await cur.close()
+            await conn.set_autocommit(False)
+
+    return applied_now
+
+
+async def _main():
+    import db
+
+    await db.open_pool()
+    try:
+        applied = await migrate()
+        print(f"{len(applied)} migration(s) applied" if applied else "Schema is up to date")
+    finally:
+        await db.close_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -0,0 +1,113 @@
+-- Baseline: the schema as previously documented in README.md.
+-- Written with IF NOT EXISTS so databases created by hand from the README
+-- are adopted as-is.
+
+-- 番剧表
+CREATE TABLE IF NOT EXISTS Anime (
+    id SERIAL PRIMARY KEY,
+    title VARCHAR(255) NOT NULL,
+    start_date DATE,
+    total_episodes INT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    source_id VARCHAR(100),
+    cover_image_url TEXT
+);
+-- Bangumi 数据指纹，未变化时同步跳过写入
+ALTER TABLE Anime ADD COLUMN IF NOT EXISTS bangumi_fingerprint VARCHAR(64);
+
+-- 剧集表
+CREATE TABLE IF NOT EXISTS Episode (
+    id SERIAL PRIMARY KEY,
+    anime_id INT NOT NULL REFERENCES Anime(id),
+    episode_code VARCHAR(255) NOT NULL,
+    episode_type VARCHAR(255) NOT NULL,
+    display_order INT NOT NULL,
+    title VARCHAR(255),
+    air_date DATE,
+    UNIQUE (anime_id, episode_code)
+);
+
+-- 剧集评价
+CREATE TABLE IF NOT EXISTS EpisodeReview (
+    id SERIAL PRIMARY KEY,
+    episode_id INT NOT NULL REFERENCES Episode(id),
+    score INT CHECK (score >=0 AND score <=10),
+    comment TEXT,
+    reviewed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (episode_id)
+);
+
+-- 番剧总评
+CREATE TABLE IF NOT EXISTS AnimeReview (
+    id SERIAL PRIMARY KEY,
+    anime_id INT NOT NULL REFERENCES Anime(id),
+    score INT CHECK (score >=0 AND score <=10),
+    comment TEXT,
+    reviewed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (anime_id)
+);
+
+-- 收藏夹
+CREATE TABLE IF NOT EXISTS Collection (
+    id SERIAL PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    description TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 收藏夹-番剧关联表（多对多）
+CREATE TABLE IF NOT EXISTS CollectionAnime (
+    collection_id INT REFERENCES Collection(id),
+    anime_id INT REFERENCES Anime(id),
+    PRIMARY KEY (collection_id, anime_id)
+);
+
+-- 批量导入断点（用于中断后继续导入）
+CREATE TABLE IF NOT EXISTS ImportCheckpoint (
+    username VARCHAR(255) NOT NULL,
+    collection_type INT NOT NULL,
+    next_offset INT NOT NULL DEFAULT 0,
+    total INT,
+    completed BOOLEAN NOT NULL DEFAULT FALSE,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (username, collection_type)
+);
+
+-- 番剧列表排序 / 分页索引（与 GET /anime 的排序表达式一致）
+CREATE INDEX IF NOT EXISTS anime_created_at_idx ON Anime ((COALESCE(created_at, TIMESTAMP '1970-01-01')), id);
+CREATE INDEX IF NOT EXISTS anime_start_date_idx ON Anime ((COALESCE(start_date, DATE '9999-12-31')), id);
+CREATE INDEX IF NOT EXISTS anime_title_idx ON Anime (title, id);
+CREATE INDEX IF NOT EXISTS animereview_score_idx ON AnimeReview (score, anime_id);
+
+-- 数据版本号：写入时由触发器递增，读接口据此生成 ETag
+CREATE TABLE IF NOT EXISTS DataVersion (
+    table_name VARCHAR(64) PRIMARY KEY,
+    version BIGINT NOT NULL
+);
+
+CREATE OR REPLACE FUNCTION bump_data_version() RETURNS trigger AS $$
+BEGIN
+    -- 只在确实有行变化时递增；初值取当前时间（微秒），重建数据库后也不会与旧 ETag 重复
+    IF EXISTS (SELECT 1 FROM changed_rows) THEN
+        INSERT INTO DataVersion (table_name, version)
+        VALUES (TG_TABLE_NAME, (EXTRACT(EPOCH FROM clock_timestamp()) * 1000000)::BIGINT)
+        ON CONFLICT (table_name) DO UPDATE SET version = DataVersion.version + 1;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    t TEXT;
+BEGIN
+    FOREACH t IN ARRAY ARRAY['anime', 'episode', 'episodereview', 'animereview', 'collection', 'collectionanime'] LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I', t || '_version_insert', t);
+        EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I', t || '_version_update', t);
+        EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I', t || '_version_delete', t);
+        EXECUTE format('CREATE TRIGGER %I AFTER INSERT ON %I REFERENCING NEW TABLE AS changed_rows FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version()', t || '_version_insert', t);
+        EXECUTE format('CREATE TRIGGER %I AFTER UPDATE ON %I REFERENCING NEW TABLE AS changed_rows FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version()', t || '_version_update', t);
+        EXECUTE format('CREATE TRIGGER %I AFTER DELETE ON %I REFERENCING OLD TABLE AS changed_rows FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version()', t || '_version_delete', t);
+    END LOOP;
+END
+$$;
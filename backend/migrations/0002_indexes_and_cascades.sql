@@ -0,0 +1,55 @@
+-- source_id lookups (create / check_import / import_collection) and a
+-- real uniqueness guarantee instead of check-then-insert.
+DO $$
+DECLARE
+    duplicates TEXT;
+BEGIN
+    SELECT string_agg(source_id, ', ') INTO duplicates
+    FROM (
+        SELECT source_id FROM Anime
+        WHERE source_id IS NOT NULL
+        GROUP BY source_id
+        HAVING count(*) > 1
+        LIMIT 20
+    ) d;
+    IF duplicates IS NOT NULL THEN
+        RAISE EXCEPTION 'Duplicate Anime.source_id values, delete the extra rows first: %', duplicates;
+    END IF;
+END
+$$;
+CREATE UNIQUE INDEX IF NOT EXISTS anime_source_id_key ON Anime (source_id);
+
+-- Lookups / deletes by anime (the primary key only covers collection_id first)
+CREATE INDEX IF NOT EXISTS collectionanime_anime_id_idx ON CollectionAnime (anime_id);
+
+-- Same order as GET /anime/{id}/episodes, so the listing is an index scan
+CREATE INDEX IF NOT EXISTS episode_listing_order_idx ON Episode (
+    anime_id,
+    (CASE
+        WHEN episode_type = 'main' THEN 0
+        WHEN episode_type = 'sp' THEN 2
+        WHEN episode_type = 'ova' THEN 3
+        ELSE 1
+    END),
+    air_date,
+    episode_code
+);
+
+-- Deleting an anime / episode / collection removes everything hanging off it
+ALTER TABLE Episode
+    DROP CONSTRAINT IF EXISTS episode_anime_id_fkey,
+    ADD CONSTRAINT episode_anime_id_fkey FOREIGN KEY (anime_id) REFERENCES Anime(id) ON DELETE CASCADE;
+
+ALTER TABLE EpisodeReview
+    DROP CONSTRAINT IF EXISTS episodereview_episode_id_fkey,
+    ADD CONSTRAINT episodereview_episode_id_fkey FOREIGN KEY (episode_id) REFERENCES Episode(id) ON DELETE CASCADE;
+
+ALTER TABLE AnimeReview
+    DROP CONSTRAINT IF EXISTS animereview_anime_id_fkey,
+    ADD CONSTRAINT animereview_anime_id_fkey FOREIGN KEY (anime_id) REFERENCES Anime(id) ON DELETE CASCADE;
+
+ALTER TABLE CollectionAnime
+    DROP CONSTRAINT IF EXISTS collectionanime_collection_id_fkey,
+    ADD CONSTRAINT collectionanime_collection_id_fkey FOREIGN KEY (collection_id) REFERENCES Collection(id) ON DELETE CASCADE,
+    DROP CONSTRAINT IF EXISTS collectionanime_anime_id_fkey,
+    ADD CONSTRAINT collectionanime_anime_id_fkey FOREIGN KEY (anime_id) REFERENCES Anime(id) ON DELETE CASCADE;
@@ -0,0 +1,21 @@
+-- Trigram indexes for GET /anime/search. pg_trgm ships with PostgreSQL's
+-- contrib package; where it is missing (or the role may not create
+-- extensions) search still works through unindexed ILIKE.
+DO $$
+BEGIN
+    CREATE EXTENSION IF NOT EXISTS pg_trgm;
+EXCEPTION WHEN OTHERS THEN
+    RAISE NOTICE 'pg_trgm is not available, library search will not be indexed: %', SQLERRM;
+END
+$$;
+
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+        CREATE INDEX IF NOT EXISTS anime_title_trgm_idx ON Anime USING gin (title gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS episode_title_trgm_idx ON Episode USING gin (title gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS animereview_comment_trgm_idx ON AnimeReview USING gin (comment gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS episodereview_comment_trgm_idx ON EpisodeReview USING gin (comment gin_trgm_ops);
+    END IF;
+END
+$$;
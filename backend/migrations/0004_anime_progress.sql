@@ -0,0 +1,36 @@
+-- Per-anime watch progress, refreshed by the API whenever an anime's
+-- episodes or episode reviews change, so listings read it with a primary
+-- key join instead of aggregating EpisodeReview per request.
+CREATE TABLE IF NOT EXISTS AnimeProgress (
+    anime_id INT PRIMARY KEY REFERENCES Anime(id) ON DELETE CASCADE,
+    main_episodes INT NOT NULL DEFAULT 0,     -- 正片集数
+    watched_episodes INT NOT NULL DEFAULT 0,  -- 已评价的正片集数
+    avg_episode_score NUMERIC(4, 2),
+    last_episode_score INT,                   -- 最近一次评价的分数
+    last_reviewed_at TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+DROP TRIGGER IF EXISTS animeprogress_version_insert ON AnimeProgress;
+DROP TRIGGER IF EXISTS animeprogress_version_update ON AnimeProgress;
+DROP TRIGGER IF EXISTS animeprogress_version_delete ON AnimeProgress;
+CREATE TRIGGER animeprogress_version_insert AFTER INSERT ON AnimeProgress
+    REFERENCING NEW TABLE AS changed_rows FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version();
+CREATE TRIGGER animeprogress_version_update AFTER UPDATE ON AnimeProgress
+    REFERENCING NEW TABLE AS changed_rows FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version();
+CREATE TRIGGER animeprogress_version_delete AFTER DELETE ON AnimeProgress
+    REFERENCING OLD TABLE AS changed_rows FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version();
+
+-- Backfill
+INSERT INTO AnimeProgress (anime_id, main_episodes, watched_episodes, avg_episode_score, last_episode_score, last_reviewed_at)
+SELECT a.id,
+       count(e.id) FILTER (WHERE e.episode_type = 'main'),
+       count(er.id) FILTER (WHERE e.episode_type = 'main'),
+       round(avg(er.score), 2),
+       (array_agg(er.score ORDER BY er.reviewed_at DESC NULLS LAST, er.id DESC) FILTER (WHERE er.id IS NOT NULL))[1],
+       max(er.reviewed_at)
+FROM Anime a
+LEFT JOIN Episode e ON e.anime_id = a.id
+LEFT JOIN EpisodeReview er ON er.episode_id = e.id
+GROUP BY a.id
+ON CONFLICT (anime_id) DO NOTHING;
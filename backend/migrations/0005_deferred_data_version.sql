@@ -0,0 +1,52 @@
+-- Bump DataVersion at commit instead of per statement. Upserting the
+-- shared DataVersion row from every write statement held its row lock
+-- until commit, so concurrent writers to a table ran one at a time, and
+-- transactions touching tables in different orders (e.g. a sync updating
+-- anime then episodes next to an episode delete) could deadlock.
+--
+-- Statements now only note the tables they changed in
+-- DataVersionPending; a deferred trigger on it bumps all of them right
+-- before commit, in table name order, in the same transaction as the
+-- data, so a reader never sees a new version with old rows.
+CREATE TABLE IF NOT EXISTS DataVersionPending (
+    xact_id BIGINT NOT NULL,
+    table_name VARCHAR(64) NOT NULL,
+    PRIMARY KEY (xact_id, table_name)
+);
+
+CREATE OR REPLACE FUNCTION bump_data_version() RETURNS trigger AS $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM changed_rows) THEN
+        INSERT INTO DataVersionPending (xact_id, table_name)
+        VALUES (txid_current(), TG_TABLE_NAME)
+        ON CONFLICT DO NOTHING;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION flush_data_versions() RETURNS trigger AS $$
+DECLARE
+    tables TEXT[];
+    t TEXT;
+BEGIN
+    -- Fires once per pending row; the first firing takes every table of
+    -- the transaction and the rest find nothing left
+    WITH flushed AS (
+        DELETE FROM DataVersionPending WHERE xact_id = txid_current() RETURNING table_name
+    )
+    SELECT array_agg(table_name ORDER BY table_name) INTO tables FROM flushed;
+
+    -- One at a time in a fixed order, so concurrent commits never wait on each other in a cycle
+    FOREACH t IN ARRAY coalesce(tables, '{}') LOOP
+        INSERT INTO DataVersion (table_name, version)
+        VALUES (t, (EXTRACT(EPOCH FROM clock_timestamp()) * 1000000)::BIGINT)
+        ON CONFLICT (table_name) DO UPDATE SET version = DataVersion.version + 1;
+    END LOOP;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS dataversionpending_flush ON DataVersionPending;
+CREATE CONSTRAINT TRIGGER dataversionpending_flush AFTER INSERT ON DataVersionPending
+    DEFERRABLE INITIALLY DEFERRED FOR EACH ROW EXECUTE FUNCTION flush_data_versions();
@@ -0,0 +1,26 @@
+-- AnimeProgress scores now cover main episodes only, like the counts
+-- (0004 averaged SP / OP / ED reviews in too). Recompute every row, and
+-- add the rows missing for anime imported without any episode change.
+INSERT INTO AnimeProgress AS p (anime_id, main_episodes, watched_episodes, avg_episode_score, last_episode_score, last_reviewed_at)
+SELECT a.id,
+       count(e.id) FILTER (WHERE e.episode_type = 'main'),
+       count(er.id) FILTER (WHERE e.episode_type = 'main'),
+       round(avg(er.score) FILTER (WHERE e.episode_type = 'main'), 2),
+       (array_agg(er.score ORDER BY er.reviewed_at DESC NULLS LAST, er.id DESC)
+           FILTER (WHERE er.id IS NOT NULL AND e.episode_type = 'main'))[1],
+       max(er.reviewed_at) FILTER (WHERE e.episode_type = 'main')
+FROM Anime a
+LEFT JOIN Episode e ON e.anime_id = a.id
+LEFT JOIN EpisodeReview er ON er.episode_id = e.id
+GROUP BY a.id
+ON CONFLICT (anime_id) DO UPDATE SET
+    main_episodes = EXCLUDED.main_episodes,
+    watched_episodes = EXCLUDED.watched_episodes,
+    avg_episode_score = EXCLUDED.avg_episode_score,
+    last_episode_score = EXCLUDED.last_episode_score,
+    last_reviewed_at = EXCLUDED.last_reviewed_at,
+    updated_at = CURRENT_TIMESTAMP
+WHERE (p.main_episodes, p.watched_episodes, p.avg_episode_score, p.last_episode_score, p.last_reviewed_at)
+      IS DISTINCT FROM
+      (EXCLUDED.main_episodes, EXCLUDED.watched_episodes, EXCLUDED.avg_episode_score,
+       EXCLUDED.last_episode_score, EXCLUDED.last_reviewed_at);
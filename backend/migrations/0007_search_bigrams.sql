@@ -0,0 +1,28 @@
+-- Character n-gram indexes for GET /anime/search. Trigram indexes can't
+-- serve patterns under three characters (the usual length of a Chinese /
+-- Japanese query), and pg_trgm skips non-ASCII text entirely in a C
+-- locale database, so substring matching on CJK text scanned every row.
+--
+-- search_grams() is the set of lower-cased 1- and 2-character grams of a
+-- text; a row can only contain the query if its grams include the
+-- query's (search_query_grams(): its bigrams, or the character itself).
+-- The GIN indexes below find those rows and ILIKE rechecks them.
+CREATE OR REPLACE FUNCTION search_grams(value TEXT) RETURNS TEXT[] AS $$
+    SELECT coalesce(array_agg(DISTINCT substr(lower(value), i, n)), '{}')
+    FROM generate_series(1, char_length(value)) AS i, (VALUES (1), (2)) AS sizes (n)
+    WHERE i + n - 1 <= char_length(value)
+$$ LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE;
+
+CREATE OR REPLACE FUNCTION search_query_grams(value TEXT) RETURNS TEXT[] AS $$
+    SELECT CASE WHEN char_length(value) = 1 THEN ARRAY[lower(value)]
+                ELSE ARRAY(
+                    SELECT DISTINCT substr(lower(value), i, 2)
+                    FROM generate_series(1, char_length(value) - 1) AS i
+                )
+           END
+$$ LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE;
+
+CREATE INDEX IF NOT EXISTS anime_title_grams_idx ON Anime USING gin (search_grams(title));
+CREATE INDEX IF NOT EXISTS episode_title_grams_idx ON Episode USING gin (search_grams(title));
+CREATE INDEX IF NOT EXISTS animereview_comment_grams_idx ON AnimeReview USING gin (search_grams(comment));
+CREATE INDEX IF NOT EXISTS episodereview_comment_grams_idx ON EpisodeReview USING gin (search_grams(comment));
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Any, Literal, Optional
 from datetime import date, datetime
 
 
@@ -11,6 +11,14 @@ class AnimeCreate(BaseModel):
     cover_image_url: Optional[str] = None
 
 
+class AnimeProgressOut(BaseModel):
+    main_episodes: int
+    watched_episodes: int  # main episodes with a review
+    avg_episode_score: Optional[float]  # of the main episode reviews, like the fields below
+    last_episode_score: Optional[int]
+    last_reviewed_at: Optional[datetime]
+
+
 class AnimeOut(BaseModel):
     id: int
     title: str
@@ -20,6 +28,11 @@ class AnimeOut(BaseModel):
     source_id: Optional[str]
     cover_image_url: Optional[str]
     my_score: Optional[int] = None
+    progress: Optional[AnimeProgressOut] = None
+
+
+class AnimeBulkDelete(BaseModel):
+    ids: list[int] = Field(..., min_length=1, max_length=1000)
 
 
 class EpisodeCreate(BaseModel):
@@ -49,6 +62,18 @@ class EpisodeReviewOut(BaseModel):
     reviewed_at: datetime
 
 
+class EpisodeReviewBatchItem(EpisodeReviewCreate):
+    episode_code: str
+
+
+class EpisodeReviewBatch(BaseModel):
+    reviews: list[EpisodeReviewBatchItem] = Field(..., min_length=1, max_length=1000)
+
+
+class EpisodeWithReviewOut(EpisodeOut):
+    review: Optional[EpisodeReviewOut] = None
+
+
 class AnimeReviewCreate(BaseModel):
     score: Optional[int] = Field(None, ge=0, le=10)
     comment: Optional[str] = None
@@ -72,7 +97,78 @@ class CollectionOut(BaseModel):
     created_at: datetime
 
 
+class CollectionRef(BaseModel):
+    id: int
+    name: str
+
+
+class AnimeListQuery(BaseModel):
+    # Keyset pagination: pass the previous page's X-Next-Cursor header back
+    limit: int = Field(50, ge=1, le=500)
+    cursor: Optional[str] = None
+    sort: Literal["created_at", "score", "start_date", "title"] = "created_at"
+    order: Literal["asc", "desc"] = "desc"
+    # Filters; all optional, combined with AND
+    min_score: Optional[int] = Field(None, ge=0, le=10)
+    max_score: Optional[int] = Field(None, ge=0, le=10)
+    reviewed: Optional[bool] = None  # has an AnimeReview or not
+    year: Optional[int] = Field(None, ge=1900, le=2100)  # start_date year
+    season: Optional[Literal["winter", "spring", "summer", "fall"]] = None  # Jan / Apr / Jul / Oct
+    episode_type: Optional[str] = None  # has at least one episode of this type
+
+
+class AnimeSearchHit(AnimeOut):
+    rank: float
+    matched: list[str]  # "comment" / "episode" / "title"
+
+
+class AnimeSearchOut(BaseModel):
+    total: Optional[int]  # None when offset is past the last result
+    results: list[AnimeSearchHit]
+
+
+class AnimeDetailOut(AnimeOut):
+    review: Optional[AnimeReviewOut] = None
+    episode_counts: dict[str, int] = {}  # episode_type -> count
+    total_episode_count: int = 0
+    reviewed_episode_count: int = 0
+    collections: list[CollectionRef] = []
+
+
+class CollectionDetailOut(CollectionOut):
+    anime_count: int = 0
+
+
 class CollectionAnimeCreate(BaseModel):
     anime_id: int
 
 
+class CollectionAnimeBatch(BaseModel):
+    anime_ids: list[int] = Field(..., min_length=1, max_length=1000)
+
+
+class LibrarySyncRequest(BaseModel):
+    # Filters; all optional, combined with AND
+    collection_id: Optional[int] = None
+    source_id_prefix: Optional[str] = None
+    aired_within_days: Optional[int] = Field(None, ge=0, le=3650)
+    concurrency: Optional[int] = Field(None, ge=1, le=16)
+    revalidate: bool = True
+    background: bool = False  # run as a job, see GET /jobs/{id}
+
+
+class JobOut(BaseModel):
+    id: str
+    kind: str
+    status: str  # pending / running / completed / failed / cancelled
+    params: dict
+    progress: dict
+    done: int
+    total: Optional[int]
+    eta_seconds: Optional[float]
+    errors: list[str]
+    error: Optional[str]
+    result: Optional[Any]
+    created_at: datetime
+    started_at: Optional[datetime]
+    finished_at: Optional[datetime]
@@ -0,0 +1,66 @@
+"""
+Circuit breaker behaviour of the Bangumi client, against a mocked API.
+
+    python -m unittest test_bangumi
+"""
+import asyncio
+import unittest
+
+import httpx
+
+import bangumi
+
+
+class TrialCallTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.slow = asyncio.Event()
+        self.calls = 0
+        # Status of the first responses, then 200s
+        self.statuses = [503]
+
+        async def handler(request):
+            self.calls += 1
+            if self.statuses:
+                return httpx.Response(self.statuses.pop(0))
+            if self.slow.is_set():
+                await asyncio.sleep(5)
+            subject_id = int(request.url.path.rsplit("/", 1)[1])
+            return httpx.Response(200, json={"id": subject_id})
+
+        self.saved = bangumi.client, bangumi._breaker, bangumi.CACHE_ENABLED
+        bangumi.client = httpx.AsyncClient(base_url="http://bangumi.test", transport=httpx.MockTransport(handler))
+        bangumi._breaker = bangumi.CircuitBreaker(threshold=1, reset_timeout=0)
+        bangumi.CACHE_ENABLED = False
+
+    async def asyncTearDown(self):
+        await bangumi.client.aclose()
+        bangumi.client, bangumi._breaker, bangumi.CACHE_ENABLED = self.saved
+
+    async def test_cancelled_trial_does_not_leave_circuit_half_open(self):
+        with self.assertRaises(httpx.HTTPStatusError):
+            await bangumi.get_subject(1, retries=0)
+        self.assertEqual(bangumi._breaker.state, "open")
+
+        # The trial call is still waiting on Bangumi when the deadline cancels it
+        self.slow.set()
+        self.assertEqual(await bangumi.get_subjects([2], deadline=0.3), {})
+        self.assertEqual(bangumi._breaker.state, "open")
+
+        self.slow.clear()
+        self.assertEqual(await bangumi.get_subject(3, retries=0), {"id": 3})
+        self.assertEqual(bangumi._breaker.state, "closed")
+
+    async def test_throttled_trial_closes_the_circuit(self):
+        self.statuses = [503, 429]
+        with self.assertRaises(httpx.HTTPStatusError):
+            await bangumi.get_subject(1, retries=0)
+        self.assertEqual(bangumi._breaker.state, "open")
+
+        # The trial gets a 429; its own retry goes through instead of failing fast
+        self.assertEqual(await bangumi.get_subject(2, retries=1), {"id": 2})
+        self.assertEqual(bangumi._breaker.state, "closed")
+        self.assertEqual(self.calls, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()